@@ -0,0 +1,174 @@
+##################################################################
+# Asyncio Transport Engine
+#
+# Runs the Sender and Receiver state machines from helper.py on an
+# asyncio event loop. Datagrams are delivered by DatagramProtocol
+# callbacks and retransmission/delayed ack timers are scheduled on
+# the loop, so many transfers can share one process.
+#
+# >>> sender = await send_file("localhost", 8000, "a.txt", 256, 64, 600)
+# >>> receiver = await receive_file(8000, "FileReceived.txt")
+##################################################################
+
+##################################################################
+# Imports
+##################################################################
+
+import asyncio
+import socket
+from helper import *
+
+##################################################################
+# Types and Constants
+##################################################################
+
+# Initial sequence numbers, matching sender.py and receiver.py
+SENDER_ISN = 121
+RECEIVER_ISN = 154
+
+##################################################################
+# Sender Protocol Class
+##################################################################
+
+class SenderProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, sender, file, done) -> None:
+        '''Initialise protocol for a Sender whose client is set once connected'''
+        self.sender = sender
+        self.file = file
+        self.done = done
+        self.state = State.CLOSED
+        self.timer = None
+
+    def connection_made(self, transport) -> None:
+        '''Attach the transport and open the connection'''
+        self.sender.client = transport
+        self.sender.connect(self.file)
+        self.state = State.SYN_SENT
+
+    def datagram_received(self, msg, addr) -> None:
+        '''Advance the connection state machine with a received packet. Packets of 
+        another connection, or of the wrong type during the handshake, are ignored'''
+        expect = { State.SYN_SENT: Packet.SYNACK, State.FIN_WAIT: Packet.FINACK }.get(self.state)
+        if not self.sender.accepts(msg, expect): return
+        if self.state == State.SYN_SENT:
+            self.sender.handle(msg, handshake=True)
+            self.sender.send(Data.NONE, Packet.ACK, handshake=True)
+            self.file = self.sender.source(self.file)
+            self.state = State.ESTABLISHED
+        elif self.state == State.ESTABLISHED: self.sender.handle(msg)
+        elif self.state == State.FIN_WAIT:
+            self.sender.handle(msg, handshake=True)
+            self.sender.send(Data.NONE, Packet.ACK, handshake=True)
+            return self.close()
+        self.pump()
+
+    def error_received(self, exc) -> None:
+        '''Ignore ICMP errors, lost packets are retransmitted on timeout'''
+        pass
+
+    def connection_lost(self, exc) -> None:
+        '''Fail the transfer if the transport closes early'''
+        if not self.done.done(): self.done.set_exception(exc or ConnectionError("closed"))
+
+    def pump(self) -> None:
+        '''Send as much data as the window and pacer allow, retransmit on timeout, and 
+        either rearm the timer or start teardown once everything is acknowledged'''
+        if self.state != State.ESTABLISHED: return
+        self.sender.poll_send(self.file)
+        self.sender.check_timeout()
+        self.sender.flush()
+        if self.timer: self.timer.cancel()
+        if self.file.offset < self.file.size or not self.sender.is_empty():
+            self.timer = asyncio.get_running_loop().call_later(self.sender.time_to_wait(), self.pump)
+            return
+        self.sender.send(Data.NONE, Packet.FIN, handshake=True)
+        self.state = State.FIN_WAIT
+
+    def close(self) -> None:
+        '''Finish the transfer'''
+        self.state = State.CLOSED
+        if self.timer: self.timer.cancel()
+        self.sender.client.close()
+        if not self.done.done(): self.done.set_result(self.sender)
+
+##################################################################
+# Receiver Protocol Class
+##################################################################
+
+class ReceiverProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, receiver, done) -> None:
+        '''Initialise protocol for a Receiver whose server is set once bound'''
+        self.receiver = receiver
+        self.done = done
+        self.timer = None
+
+    def connection_made(self, transport) -> None:
+        '''Attach the transport'''
+        self.receiver.server = transport
+
+    def datagram_received(self, msg, addr) -> None:
+        '''Advance the connection state machine with a received packet'''
+        self.receiver.addr = addr
+        self.receiver.step(msg)
+        if self.receiver.state == State.CLOSED: return self.close()
+        self.__arm_delayed_ack()
+
+    def error_received(self, exc) -> None:
+        '''Ignore ICMP errors from the sender's side'''
+        pass
+
+    def connection_lost(self, exc) -> None:
+        '''Fail the transfer if the transport closes early'''
+        if not self.done.done(): self.done.set_exception(exc or ConnectionError("closed"))
+
+    def __arm_delayed_ack(self) -> None:
+        '''Schedule the pending delayed ack, if any'''
+        if self.timer: self.timer.cancel()
+        wait = self.receiver.ack_wait()
+        if wait is not None:
+            self.timer = asyncio.get_running_loop().call_later(wait, self.__delayed_ack)
+
+    def __delayed_ack(self) -> None:
+        '''Send the delayed ack once its timer expires'''
+        if self.receiver.state == State.ESTABLISHED and self.receiver.ack_wait() is not None:
+            self.receiver.send(Data.NONE, Packet.ACK)
+
+    def close(self) -> None:
+        '''Finish the transfer'''
+        if self.timer: self.timer.cancel()
+        self.receiver.server.close()
+        if not self.done.done(): self.done.set_result(self.receiver)
+
+##################################################################
+# Transfers
+##################################################################
+
+async def send_file(host, port, filename, MWS, MSS, timeout, pdrop=0.0, seed=None,
+        codec="binary", cc="reno") -> Sender:
+    '''Send a file to a receiver. Return the Sender for its log and stats'''
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    sender = Sender(None, SENDER_ISN, 0, int(MWS/MSS), (host, port), CODECS[codec]())
+    sender.set_PL_module(seed, pdrop)
+    sender.set_window(MSS, MWS)
+    sender.set_rto(timeout, MIN_RTO, MAX_RTO)
+    sender.set_congestion_control(CONGESTION_CONTROLS[cc](MSS))
+    with FileSource(filename) as file:
+        await loop.create_datagram_endpoint(lambda: SenderProtocol(sender, file, done),
+            family=socket.AF_INET)
+        return await done
+
+async def receive_file(port, filename, ip="127.0.0.1", codec="binary", ack_every=1,
+        ack_delay=ACK_DELAY) -> Receiver:
+    '''Receive one file on a port. Return the Receiver for its log and stats'''
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    receiver = Receiver(None, RECEIVER_ISN, 0, CODECS[codec]())
+    receiver.set_delayed_ack(ack_every, ack_delay)
+    with FileSink(filename) as sink:
+        receiver.set_sink(sink)
+        await loop.create_datagram_endpoint(lambda: ReceiverProtocol(receiver, done),
+            local_addr=(ip, port))
+        return await done
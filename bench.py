@@ -0,0 +1,212 @@
+##################################################################
+# Transfer Benchmark Suite
+#
+# Runs receiver.py and sender.py over loopback across a matrix of
+# file sizes, MSS, MWS, timeouts and loss rates, repeating each
+# point with fixed seeds. Records transfer time, goodput,
+# retransmissions and CPU time per process into a JSON results file
+# and compares the medians against a saved baseline. Exits with
+# status 1 if any transfer fails or regresses past the tolerance.
+# Transfer time runs from the sender's first to last packet, as its
+# log reports, so interpreter startup is not counted.
+# With --proxy-args each transfer runs through proxy.py on port + 1
+# with those impairments, instead of the sender's drop module alone.
+#
+# USAGE: python bench.py [--sizes 20000,1000000] [--mss 64,1000] [--mws 4096,64000]
+#            [--timeout 100] [--loss 0.01,0.1] [--repeats 3] [--port 8400]
+#            [--out bench.json] [--baseline baseline.json] [--tolerance 0.1]
+#            [--limit 300] [--sender-args "--cc cubic"] [--receiver-args "--gro"]
+#            [--proxy-args "--fwd-delay 20 --rev-delay 20"]
+##################################################################
+
+##################################################################
+# Imports
+##################################################################
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import resource
+import tempfile
+import signal
+import itertools
+import statistics
+import subprocess
+from helper import parse_options
+
+##################################################################
+# Constants
+##################################################################
+
+BENCH_ERROR = \
+    'USAGE: python bench.py [--sizes 20000,1000000] [--mss 64,1000] [--mws 4096,64000] ' \
+    + '[--timeout 100] [--loss 0.01,0.1] [--repeats 3] [--port 8400] [--out bench.json] ' \
+    + '[--baseline baseline.json] [--tolerance 0.1] [--limit 300] [--sender-args ARGS] ' \
+    + '[--receiver-args ARGS] [--proxy-args ARGS]'
+
+# Directory holding sender.py and receiver.py
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds to let the receiver bind before the sender starts
+STARTUP = 0.3
+
+# Fields compared against the baseline and whether larger is better
+METRICS = { "goodput_mbps": True, "seconds": False, "cpu_sender": False, "cpu_receiver": False }
+
+##################################################################
+# Benchmark
+##################################################################
+
+def children_cpu() -> float:
+    '''Return user plus system CPU seconds of reaped child processes'''
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def statistic(path, label, kind=int) -> int:
+    '''Return a statistic of type kind from a text log, or None if it is missing'''
+    with open(path) as logfile:
+        for line in logfile:
+            if line.startswith(label): return kind(line.split(":")[1])
+    return None
+
+def proxy_stats(output) -> dict:
+    '''Parse the per-direction statistics proxy.py prints on exit'''
+    stats = dict()
+    for line in output.splitlines():
+        name, values = line.split(":", 1)
+        values = values.split()
+        stats[name] = { values[i]: int(values[i + 1]) for i in range(0, len(values), 2) }
+    return stats
+
+def run(workdir, filename, port, MSS, MWS, timeout, loss, seed, options) -> dict:
+    '''Transfer filename once and return its measurements'''
+    python = [sys.executable, "-u"]
+    received = os.path.join(workdir, "received.bin")
+    receiver = subprocess.Popen(python + [os.path.join(ROOT, "receiver.py"), str(port), received,
+        "--trace", "stats"] + options["receiver_args"].split(), cwd=workdir,
+        stdout=subprocess.DEVNULL)
+    proxy = None
+    if options["proxy_args"]: 
+        proxy = subprocess.Popen(python + [os.path.join(ROOT, "proxy.py"), str(port + 1), 
+            "localhost", str(port), "--seed", seed] + options["proxy_args"].split(), cwd=workdir,
+            stdout=subprocess.PIPE, text=True)
+    time.sleep(STARTUP)
+    cpu = children_cpu()
+    start = time.perf_counter()
+    sender = subprocess.Popen(python + [os.path.join(ROOT, "sender.py"), "localhost", 
+        str(port + 1 if proxy else port),
+        filename, str(MWS), str(MSS), str(timeout), str(loss), seed, "--trace", "stats"]
+        + options["sender_args"].split(), cwd=workdir, stdout=subprocess.DEVNULL)
+    try:
+        sender.wait(options["limit"])
+        wall = time.perf_counter() - start
+        cpu_sender, cpu = children_cpu() - cpu, children_cpu()
+        receiver.wait(options["limit"])
+    except subprocess.TimeoutExpired:
+        for i in (sender, receiver, proxy): 
+            if i: i.kill()
+        for i in (sender, receiver, proxy): 
+            if i: i.communicate()
+        return { "seed": seed, "ok": False, "error": "timed out" }
+    cpu_receiver = children_cpu() - cpu
+    impairments = None
+    if proxy: 
+        proxy.send_signal(signal.SIGINT)
+        impairments = proxy_stats(proxy.communicate()[0])
+    if sender.returncode or receiver.returncode:
+        return { "seed": seed, "ok": False, "error": f"exit {sender.returncode}/{receiver.returncode}" }
+    with open(filename, "rb") as a, open(received, "rb") as b: ok = a.read() == b.read()
+    size = os.path.getsize(filename)
+    sender_log = os.path.join(workdir, "Sender_log.txt")
+    seconds = statistic(sender_log, "Transfer Time (s)", float) or wall
+    return {
+        "seed": seed, "ok": ok, "seconds": seconds, "wall_seconds": wall, 
+        "goodput_mbps": size * 8 / seconds / 1e6,
+        "retransmissions": statistic(sender_log, "No. Retransmitted Segments"),
+        "retransmitted_bytes": statistic(sender_log, "Retransmitted Data (bytes)"),
+        "cpu_sender": cpu_sender, "cpu_receiver": cpu_receiver, "proxy": impairments,
+    }
+
+def median(runs) -> dict:
+    '''Return the median of each measurement over the successful runs'''
+    runs = [i for i in runs if i["ok"]]
+    if not runs: return None
+    fields = [i for i in runs[0] if i not in ("seed", "ok", "proxy")]
+    return { i: statistics.median(j[i] for j in runs if j[i] is not None) for i in fields }
+
+def point_key(point) -> tuple:
+    '''Return the configuration identifying a matrix point'''
+    return tuple(point[i] for i in ("size", "mss", "mws", "timeout", "loss"))
+
+def compare(points, baseline, tolerance) -> list:
+    '''Print medians against the baseline. Return the points that regressed'''
+    saved = { point_key(i): i["median"] for i in baseline["points"] if i["median"] }
+    regressions = list()
+    print(f"\n{'size':>9} {'mss':>5} {'mws':>6} {'rto':>5} {'loss':>5} {'metric':<13} "
+        + f"{'baseline':>10} {'current':>10} {'change':>8}")
+    for point in points:
+        old, new = saved.get(point_key(point)), point["median"]
+        if not old or not new: continue
+        for metric, larger in METRICS.items():
+            if not old.get(metric): continue
+            change = (new[metric] - old[metric]) / old[metric]
+            worse = -change if larger else change
+            flag = " !" if worse > tolerance else ""
+            if flag: regressions.append((point_key(point), metric))
+            print(f"{point['size']:>9} {point['mss']:>5} {point['mws']:>6} {point['timeout']:>5g} "
+                + f"{point['loss']:>5g} {metric:<13} {old[metric]:>10.3f} {new[metric]:>10.3f} "
+                + f"{change:>+8.1%}{flag}")
+    return regressions
+
+##################################################################
+# Runner
+##################################################################
+
+# Parse commandline arguments
+options = { "sizes": "20000,1000000", "mss": "64,1000", "mws": "4096,64000", "timeout": "100",
+    "loss": "0.01,0.1", "repeats": 3, "port": 8400, "out": "bench.json", "baseline": "",
+    "tolerance": 0.1, "limit": 300.0, "sender_args": "", "receiver_args": "", "proxy_args": "" }
+args = parse_options(sys.argv[1:], options)
+if args is None or args or options["repeats"] < 1: exit(BENCH_ERROR)
+try:
+    matrix = [[int(i) for i in options["sizes"].split(",")], [int(i) for i in options["mss"].split(",")],
+        [int(i) for i in options["mws"].split(",")], [float(i) for i in options["timeout"].split(",")],
+        [float(i) for i in options["loss"].split(",")]]
+except ValueError: exit(BENCH_ERROR)
+
+points = list()
+with tempfile.TemporaryDirectory() as workdir:
+    for size, MSS, MWS, timeout, loss in itertools.product(*matrix):
+        if MWS < MSS: continue
+        filename = os.path.join(workdir, f"data.{size}.bin")
+        if not os.path.exists(filename):
+            data = random.Random(size).getrandbits(8 * size).to_bytes(size, "little") if size else b""
+            with open(filename, "wb") as file: file.write(data)
+        runs = [run(workdir, filename, options["port"], MSS, MWS, timeout, loss, f"bench{i}", options)
+            for i in range(options["repeats"])]
+        point = { "size": size, "mss": MSS, "mws": MWS, "timeout": timeout, "loss": loss,
+            "runs": runs, "median": median(runs) }
+        points.append(point)
+        result = point["median"]
+        failed = sum(not i["ok"] for i in runs)
+        print(f"size {size:>9} mss {MSS:>5} mws {MWS:>6} rto {timeout:>5g} loss {loss:>5g}: " + (
+            f"{result['seconds']:.3f}s {result['goodput_mbps']:.2f} Mbit/s "
+            + f"{result['retransmissions']:.0f} rexmit cpu {result['cpu_sender']:.2f}/"
+            + f"{result['cpu_receiver']:.2f}s" if result else "no successful run")
+            + (f" ({failed} failed)" if failed else ""))
+
+with open(options["out"], "w") as file:
+    json.dump({ "python": platform.python_version(), "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "options": options, "points": points },
+        file, indent=2)
+print(f"\nResults written to {options['out']}")
+
+regressions = list()
+if options["baseline"]:
+    with open(options["baseline"]) as file: baseline = json.load(file)
+    regressions = compare(points, baseline, options["tolerance"])
+    print(f"\n{len(regressions)} regressions beyond {options['tolerance']:.0%}")
+if regressions or any(not j["ok"] for i in points for j in i["runs"]): exit(1)
@@ -0,0 +1,41 @@
+##################################################################
+# Codec Micro-benchmark
+#
+# Measures encode/decode cost per segment for every codec in
+# helper.CODECS.
+#
+# USAGE: python bench_codec.py [MSS] [iterations]
+##################################################################
+
+##################################################################
+# Imports
+##################################################################
+
+import sys
+import os
+import time
+from helper import CODECS, Packet
+
+##################################################################
+# Benchmark
+##################################################################
+
+def bench(codec, payload, iterations) -> tuple:
+    '''Return encode ns/segment, decode ns/segment and encoded size'''
+    start = time.perf_counter_ns()
+    for i in range(iterations): packet = codec.encode(i, 154, payload, Packet.DATA)
+    encode = (time.perf_counter_ns() - start) / iterations
+    start = time.perf_counter_ns()
+    for _ in range(iterations): codec.decode(packet)
+    decode = (time.perf_counter_ns() - start) / iterations
+    return encode, decode, len(packet)
+
+MSS = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+payload = os.urandom(MSS)
+
+print(f"MSS {MSS}, {iterations} iterations\n")
+print(f"{'codec':<8} {'encode ns':>10} {'decode ns':>10} {'bytes':>6} {'overhead':>9}")
+for name, codec in CODECS.items():
+    encode, decode, size = bench(codec(), payload, iterations)
+    print(f"{name:<8} {encode:>10.0f} {decode:>10.0f} {size:>6} {size - MSS:>9}")
@@ -0,0 +1,76 @@
+##################################################################
+# UDP GSO/GRO Loopback Benchmark
+#
+# Blasts encoded data segments over loopback for a fixed duration
+# and reports segments/sec sent and received, with one sendto and
+# recvfrom per segment versus GSO trains and GRO bursts.
+#
+# USAGE: python bench_gso.py [MSS] [seconds]
+##################################################################
+
+##################################################################
+# Imports
+##################################################################
+
+import sys
+import time
+import socket
+import struct
+import threading
+from helper import BinaryCodec, Packet, UDP_SEGMENT, UDP_GRO, GSO_MAX_SEGMENTS, \
+    GSO_MAX_BYTES, MAX_SEG_SIZE
+
+##################################################################
+# Benchmark
+##################################################################
+
+def receive(server, gro, counts, stop) -> None:
+    '''Count segments received until stopped, splitting GRO bursts by segment size'''
+    while not stop.is_set():
+        try: msg, ancdata, _, _ = server.recvmsg(MAX_SEG_SIZE, socket.CMSG_SPACE(4))
+        except socket.timeout: continue
+        size = next((struct.unpack("=i", data[:4])[0] for level, kind, data in ancdata
+            if level == socket.SOL_UDP and kind == UDP_GRO), len(msg)) if gro else len(msg)
+        counts[0] += -(-len(msg) // size)
+        counts[1] += 1
+
+def bench(MSS, seconds, offload) -> tuple:
+    '''Return segments/sec sent, segments/sec received and segments per system call'''
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 24)
+    server.bind(("127.0.0.1", 0))
+    server.settimeout(0.1)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if offload: server.setsockopt(socket.SOL_UDP, UDP_GRO, 1)
+    packet = BinaryCodec().encode(0, 0, bytes(MSS), Packet.DATA)
+    train = min(GSO_MAX_SEGMENTS, GSO_MAX_BYTES // len(packet))
+    buffer, cmsg = [packet * train], [(socket.SOL_UDP, UDP_SEGMENT, struct.pack("=H", len(packet)))]
+    counts, stop = [0, 0], threading.Event()
+    thread = threading.Thread(target=receive, args=(server, offload, counts, stop))
+    thread.start()
+    sent, end = 0, time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        if offload:
+            client.sendmsg(buffer, cmsg, 0, server.getsockname())
+            sent += train
+        else:
+            client.sendto(packet, server.getsockname())
+            sent += 1
+    time.sleep(0.2)
+    stop.set()
+    thread.join()
+    client.close()
+    server.close()
+    return sent / seconds, counts[0] / seconds, counts[0] / max(counts[1], 1)
+
+MSS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 2
+
+print(f"MSS {MSS}, {seconds}s per run over loopback\n")
+print(f"{'mode':<10} {'sent seg/s':>12} {'recv seg/s':>12} {'seg/recv call':>14}")
+for name, offload in (("plain", False), ("gso+gro", True)):
+    try: sent, received, per_call = bench(MSS, seconds, offload)
+    except OSError as e:
+        print(f"{name:<10} unavailable ({e})")
+        continue
+    print(f"{name:<10} {sent:>12.0f} {received:>12.0f} {per_call:>14.1f}")
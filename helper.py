@@ -12,10 +12,25 @@
 # Imports
 ##################################################################
 
+import os
+import abc
+import sys
+import mmap
+import socket
 import random
 import time
-import collections
+import select
+import heapq
+import bisect
+import struct
+import stat
 import json
+import hashlib
+import hmac
+import zlib
+import collections
+import queue
+import threading
 
 ##################################################################
 # Types and Constants
@@ -29,58 +44,1498 @@ class Packet:
     SYNACK = "SA"
     FIN = "F"
     FINACK = "FA"
+    PARITY = "P"
 
 # Packet action types
 class Action:
     SEND = "snd"
     RECEIVE = "rcv"
     DROP = "drop"
+    RECOVER = "fec"
+
+# Trace levels
+class Trace:
+    OFF = "off"
+    STATS = "stats"
+    FULL = "full"
+
+# Compression algorithms negotiated in the handshake
+class Compression:
+    ZLIB = 1
+
+# Frame kinds of the compressed stream
+class Frame:
+    RAW = 0
+    DEFLATE = 1
+    DEFLATE_NEW = 2
+
+# Session kinds negotiated in the handshake: a list of files, or a directory tree whose
+# manifests are exchanged first
+class Session:
+    FILES = 0
+    TREE = 1
+
+# Record kinds of the delta stream
+class Record:
+    LITERAL = 0
+    COPY = 1
 
 # Special data types
 class Data:
-    NONE = ""
+    NONE = b""
     BUFFERED = "bfd"
+    RESET = "rst"
 
 # Sender window slot types
 class Slot:
     EMPTY = "empty"
-    ACKED = "acked"
+
+# Connection states
+class State:
+    SYN_SENT = "syn_sent"
+    LISTEN = "listen"
+    SYN_RECEIVED = "syn_rcvd"
+    ESTABLISHED = "established"
+    FIN_WAIT = "fin_wait"
+    LAST_ACK = "last_ack"
+    CLOSED = "closed"
+
+# Feature flags negotiated in the handshake
+class Feature:
+    SACK = 1
+    WINDOW = 2
+    FEC = 4
+    COMPRESS = 8
+    DELTA = 16
+    SESSION = 32
+
+# Sender loss recovery states
+class Recovery:
+    NONE = ""
+    FAST = "fast"
+    TIMEOUT = "rto"
 
 # Maximum receiver segment size of 65Kbytes with surplus
 MAX_SEG_SIZE = 66000
 
+# Largest MSS that fits one UDP datagram with the header and options
+MAX_MSS = 65000
+
+# MSS offered by --auto-mss: one 1500 byte path MTU less the IP (20), UDP (8) and binary 
+# (24) headers and up to 40 bytes of options, so a segment is not fragmented
+PATH_MTU = 1500
+AUTO_MSS = PATH_MTU - 20 - 8 - 24 - 40
+
+# Default receive buffer in bytes, the most out of order data a receiver accepts
+RECEIVE_BUFFER = 1 << 22
+
+# Features supported by this implementation
+FEATURES = Feature.SACK | Feature.WINDOW | Feature.FEC | Feature.COMPRESS | Feature.DELTA \
+    | Feature.SESSION
+
+# Bytes of file compressed per frame of the compressed stream
+COMPRESS_CHUNK = 1 << 16
+
+# Share of the time between frames spent compressing above which the adaptive level
+# drops, and below which it rises again
+COMPRESS_BUSY = 0.5
+COMPRESS_IDLE = 0.1
+
+# Smallest delta block, largest literal record and largest run of copied blocks, in bytes
+DELTA_BLOCK = 2048
+DELTA_LITERAL = 1 << 16
+DELTA_RUN = 1 << 20
+
+# Pacing rate as a multiple of cwnd / SRTT in slow start and congestion avoidance, and
+# the seconds of data the token bucket lets out at once (at least two segments)
+PACING_GAIN_SS = 2.0
+PACING_GAIN_CA = 1.2
+PACING_QUANTUM = 0.001
+
+# Files of a session up to this size are read into memory instead of mapped, so a session
+# of many small files does not hold a descriptor per file
+SESSION_INLINE = 1 << 16
+
+# Milliseconds between receiver checkpoints of a resumable transfer
+CHECKPOINT_INTERVAL = 500
+
+# Retransmission timeout defaults and clamps in milliseconds
+INITIAL_RTO = 1000
+MIN_RTO = 10
+MAX_RTO = 60000
+
+# Duplicate acknowledgements that trigger a fast retransmit
+DUP_ACK_THRESHOLD = 3
+
+# Maximum SACK blocks carried by one acknowledgement
+MAX_SACK_BLOCKS = 4
+
+# Initial congestion window in segments (RFC 6928)
+INITIAL_CWND = 10
+
+# Delayed acknowledgement timer in milliseconds
+ACK_DELAY = 40
+
+# Seconds a served connection may stay silent before it is closed
+IDLE_TIMEOUT = 60
+
+# Trace buffer records, per chunk kept in memory or handed to the flush thread
+TRACE_RECORDS = 1 << 16
+
+# Congestion window and pacing rate samples kept for a full trace, the latest ones win
+TRACE_SAMPLES = 1 << 16
+
+# Linux UDP segmentation/receive offload socket options (linux/udp.h)
+UDP_SEGMENT = 103
+UDP_GRO = 104
+GSO_MAX_SEGMENTS = 64
+GSO_MAX_BYTES = 65000
+
+# Option kinds carried in the options area as kind (1), length (1), value
+class Option:
+    MSS = 2
+    WINDOW = 3
+    SACK = 5
+    FEATURES = 32
+    FEC = 33
+    GROUP = 34
+    COMPRESS = 35
+    IDENTITY = 36
+    RESUME = 37
+    DELTA = 38
+    TOKEN = 39
+    SESSION = 40
+    OFFSET = 30
+    SIZE = 31
+
+##################################################################
+# Codec Classes
+##################################################################
+
+class BinaryCodec:
+    '''Fixed-layout header followed by an options area and raw payload. Header: connection 
+    id (2), seq (8), ack (8), packet type (1), options length (1), payload length (2). 
+    Sequence numbers are byte offsets and do not wrap'''
+
+    HEADER = struct.Struct("!HQQBBH")
+    CID = struct.Struct("!H")
+    TYPE_OFFSET = struct.calcsize("!HQQ")
+    TYPES = (Packet.SYN, Packet.ACK, Packet.DATA, Packet.SYNACK, Packet.FIN, Packet.FINACK, 
+        Packet.PARITY)
+    CODES = { j: i for i, j in enumerate(TYPES) }
+
+    def encode(self, seq, ack, data, packet_type, options=b"", cid=0) -> bytes:
+        '''Pack header and join it with options and payload'''
+        header = self.HEADER.pack(cid, seq, ack, self.CODES[packet_type], len(options), len(data))
+        return b"".join((header, options, data))
+
+    def decode(self, packet) -> tuple:
+        '''Unpack header. Return seq, ack, payload, packet type and options'''
+        _, seq, ack, code, opt_len, data_len = self.HEADER.unpack_from(packet)
+        start = self.HEADER.size + opt_len
+        return seq, ack, packet[start:start + data_len], self.TYPES[code], packet[self.HEADER.size:start]
+
+    def connection_id(self, packet) -> int:
+        '''Return the connection id without decoding the rest of the packet'''
+        return self.CID.unpack_from(packet)[0]
+
+    def packet_type(self, packet) -> str:
+        '''Return the packet type without decoding the rest of the packet'''
+        return self.TYPES[packet[self.TYPE_OFFSET]]
+
+class JSONCodec:
+    '''Human readable codec kept for debugging. Payload bytes are carried as latin-1 text'''
+
+    def encode(self, seq, ack, data, packet_type, options=b"", cid=0) -> bytes:
+        '''Jsonify and encode packet'''
+        return json.dumps({ "cid": cid, "seq": seq, "ack": ack, "data": bytes(data).decode("latin-1"), 
+            "p_type": packet_type, "opts": bytes(options).hex() }).encode()
+
+    def decode(self, packet) -> tuple:
+        '''Decode and extract data from jsonified packet'''
+        _, seq, ack, data, packet_type, options = json.loads(packet.decode()).values()
+        return seq, ack, data.encode("latin-1"), packet_type, bytes.fromhex(options)
+
+    def connection_id(self, packet) -> int:
+        '''Return the connection id'''
+        return json.loads(packet.decode())["cid"]
+
+    def packet_type(self, packet) -> str:
+        '''Return the packet type'''
+        return json.loads(packet.decode())["p_type"]
+
+# Available codecs by commandline name
+CODECS = { "binary": BinaryCodec, "json": JSONCodec }
+
+##################################################################
+# Options
+##################################################################
+
+SACK_BLOCK = struct.Struct("!QQ")
+UINT16 = struct.Struct("!H")
+UINT32 = struct.Struct("!I")
+UINT64 = struct.Struct("!Q")
+
+def pack_options(options) -> bytes:
+    '''Serialise a dict of option kind to value bytes'''
+    return b"".join(bytes((kind, len(value))) + value for kind, value in options.items())
+
+def unpack_options(data) -> dict:
+    '''Parse an options area into a dict of option kind to value bytes'''
+    options, i = dict(), 0
+    while i + 2 <= len(data):
+        kind, length = data[i], data[i + 1]
+        options[kind] = bytes(data[i + 2:i + 2 + length])
+        i += 2 + length
+    return options
+
+def pack_sack(blocks) -> bytes:
+    '''Serialise (start, end) SACK blocks'''
+    return b"".join(SACK_BLOCK.pack(start, end) for start, end in blocks)
+
+def unpack_sack(value) -> list:
+    '''Parse SACK option value into (start, end) blocks'''
+    return [SACK_BLOCK.unpack_from(value, i) for i in range(0, len(value), SACK_BLOCK.size)]
+
+##################################################################
+# Interval Set Class
+##################################################################
+
+class IntervalSet:
+    '''Sorted disjoint [start, end) ranges. Touching or overlapping ranges are merged. The
+    total length covered is kept up to date'''
+
+    def __init__(self) -> None:
+        '''Initialise empty set'''
+        self.starts = list()
+        self.ends = list()
+        self.covered = 0
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+    def add(self, start, end) -> None:
+        '''Add range, merging it with every range it touches'''
+        i = bisect.bisect_left(self.ends, start)
+        j = bisect.bisect_right(self.starts, end)
+        if i < j: start, end = min(start, self.starts[i]), max(end, self.ends[j - 1])
+        self.covered += end - start - sum(b - a for a, b in zip(self.starts[i:j], self.ends[i:j]))
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
+
+    def discard_below(self, point) -> None:
+        '''Remove everything below point'''
+        i = bisect.bisect_right(self.ends, point)
+        self.covered -= sum(b - a for a, b in zip(self.starts[:i], self.ends[:i]))
+        del self.starts[:i], self.ends[:i]
+        if self.starts and self.starts[0] < point: 
+            self.covered -= point - self.starts[0]
+            self.starts[0] = point
+
+    def gaps(self, start, end) -> list:
+        '''Return the parts of [start, end) not covered by the set'''
+        gaps, i = list(), bisect.bisect_right(self.ends, start)
+        while start < end:
+            if i == len(self.starts) or self.starts[i] >= end: 
+                gaps.append((start, end))
+                break
+            if self.starts[i] > start: gaps.append((start, self.starts[i]))
+            start = self.ends[i]
+            i += 1
+        return gaps
+
+    def find(self, point) -> tuple:
+        '''Return the range containing point or None'''
+        i = bisect.bisect_right(self.starts, point) - 1
+        return (self.starts[i], self.ends[i]) if i >= 0 and point < self.ends[i] else None
+
+##################################################################
+# File Source Class
+##################################################################
+
+class FileSource:
+    '''Binary-safe segment source over a memory-mapped file. Segments are memoryview
+    slices of the mapping, so the sender window references the file instead of copies'''
+
+    def __init__(self, filename, start=0, end=None) -> None:
+        '''Map the file read-only. Segments are read from start up to end, by default the 
+        whole file. Empty files cannot be mapped and use an empty buffer'''
+        with open(filename, "rb") as file:
+            length = os.fstat(file.fileno()).st_size
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if length else None
+        self.view = memoryview(self.map) if self.map else memoryview(Data.NONE)
+        self.offset = start
+        self.length = length
+        self.size = length if end is None else min(end, length)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def segment(self, offset, length) -> memoryview:
+        '''Return a view of up to length bytes starting at offset'''
+        return self.view[offset:offset + length]
+
+    def read(self, length) -> memoryview:
+        '''Return the next segment of up to length bytes, or Data.NONE at end of file'''
+        if self.offset >= self.size: return Data.NONE
+        segment = self.segment(self.offset, min(length, self.size - self.offset))
+        self.offset += len(segment)
+        return segment
+
+    def close(self) -> None:
+        '''Release the view and unmap the file. All segments must have been released'''
+        self.view.release()
+        if self.map: self.map.close()
+
+class BufferSource(FileSource):
+    '''Segment source over bytes in memory'''
+
+    def __init__(self, data) -> None:
+        '''Read segments of data from its start'''
+        self.map = None
+        self.view = memoryview(data)
+        self.offset = 0
+        self.length = self.size = len(data)
+
+##################################################################
+# Compressed Stream Classes
+##################################################################
+
+# Compressor and decompressor factories of each algorithm. Compressors take a level and
+# support sync flushes
+COMPRESSORS = {
+    Compression.ZLIB: (lambda level: zlib.compressobj(level, zlib.DEFLATED, -15), 
+        lambda: zlib.decompressobj(-15)),
+}
+
+class StreamSource(abc.ABC):
+    '''Segment source over a stream encoded from a FileSource as it is read. Subclasses
+    encode the file into the buffer, and the size becomes known once the whole file has
+    been encoded and the stream drained'''
+
+    def __init__(self, source) -> None:
+        '''Initialise an empty stream from the file source's offset'''
+        self.source = source
+        self.length = source.length
+        self.buffer = bytearray()
+        self.input = source.offset
+        self.offset = 0
+        self.size = float("inf")
+        self.consumed = 0
+        self.produced = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def read(self, length) -> bytes:
+        '''Return the next segment of up to length bytes of the stream'''
+        self.encode(length)
+        segment = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        self.offset += len(segment)
+        if self.input >= self.source.size and not self.buffer: self.size = self.offset
+        return segment
+
+    @abc.abstractmethod
+    def encode(self, length) -> None:
+        '''Encode the file until the buffer holds more than length bytes or the file ends'''
+
+    def emit(self, data) -> None:
+        '''Append encoded data to the stream'''
+        self.buffer += data
+        self.produced += len(data)
+
+    def ratio(self) -> float:
+        '''Return stream bytes per file byte'''
+        return self.produced / max(self.consumed, 1)
+
+    def close(self) -> None:
+        '''Close the underlying file source'''
+        self.source.close()
+
+class CompressedSource(StreamSource):
+    '''Segment source compressing a FileSource before segmentation, so segments stay MSS
+    sized. The stream is a sequence of frames: kind (1), length (4), payload. Deflate 
+    frames continue one compressed stream, sync flushed at each frame. A level change 
+    starts a new stream, and chunks that do not shrink are sent raw'''
+
+    FRAME = struct.Struct("!BI")
+
+    def __init__(self, source, level=6, adaptive=False, algorithm=Compression.ZLIB) -> None:
+        '''Compress source at level. An adaptive source lowers the level, down to sending
+        raw frames, while compressing takes most of the time between frames'''
+        super().__init__(source)
+        self.new_compressor = COMPRESSORS[algorithm][0]
+        self.max_level = level
+        self.level = level
+        self.adaptive = adaptive
+        self.compressor = None
+        self.stamp = time.perf_counter()
+        self.read(0)
+
+    def encode(self, length) -> None:
+        '''Compress frames until the buffer holds more than length bytes or the file ends'''
+        while len(self.buffer) <= length and self.input < self.source.size:
+            chunk = self.source.segment(self.input, min(COMPRESS_CHUNK, self.source.size - self.input))
+            self.input += len(chunk)
+            self.consumed += len(chunk)
+            self.__frame(chunk)
+
+    def __frame(self, chunk) -> None:
+        '''Append one frame holding chunk, and adapt the level to the compression cost'''
+        start = time.perf_counter()
+        kind, payload = Frame.RAW, chunk
+        if self.level:
+            kind = Frame.DEFLATE if self.compressor else Frame.DEFLATE_NEW
+            if not self.compressor: self.compressor = self.new_compressor(self.level)
+            payload = self.compressor.compress(chunk) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            if len(payload) >= len(chunk): kind, payload, self.compressor = Frame.RAW, chunk, None
+        self.emit(self.FRAME.pack(kind, len(payload)))
+        self.emit(payload)
+        now = time.perf_counter()
+        busy, self.stamp = (now - start) / max(now - self.stamp, 1e-9), now
+        if not self.adaptive: return
+        if busy > COMPRESS_BUSY and self.level: self.level, self.compressor = self.level - 1, None
+        elif busy < COMPRESS_IDLE and self.level < self.max_level: 
+            self.level, self.compressor = self.level + 1, None
+
+class StreamDecoder:
+    '''Receiving end of a CompressedSource stream. In order data is parsed into frames
+    and each frame is decoded as soon as it is complete'''
+
+    def __init__(self, algorithm=Compression.ZLIB) -> None:
+        '''Initialise with no partial frame'''
+        self.buffer = bytearray()
+        self.new_decompressor = COMPRESSORS[algorithm][1]
+        self.decompressor = None
+        self.written = 0
+
+    def decode(self, data) -> bytes:
+        '''Return the file data of every frame completed by data'''
+        self.buffer += data
+        output, offset, size = list(), 0, CompressedSource.FRAME.size
+        while len(self.buffer) - offset >= size:
+            kind, length = CompressedSource.FRAME.unpack_from(self.buffer, offset)
+            if len(self.buffer) - offset - size < length: break
+            payload = bytes(self.buffer[offset + size:offset + size + length])
+            offset += size + length
+            if kind == Frame.RAW: 
+                output.append(payload)
+                continue
+            if kind == Frame.DEFLATE_NEW: self.decompressor = self.new_decompressor()
+            output.append(self.decompressor.decompress(payload))
+        del self.buffer[:offset]
+        output = b"".join(output)
+        self.written += len(output)
+        return output
+
+##################################################################
+# Delta Transfer Classes
+##################################################################
+
+# Signature stream of a basis file: block size and block count, then the weak and strong
+# checksum of each whole block
+SIGNATURE_HEADER = struct.Struct("!II")
+SIGNATURE = struct.Struct("!I16s")
+
+def delta_block(size) -> int:
+    '''Return the block size for a basis file of size bytes: its square root, rounded
+    down to a multiple of 8, and at least DELTA_BLOCK'''
+    return max(DELTA_BLOCK, int(size ** 0.5) // 8 * 8)
+
+def strong_checksum(data) -> bytes:
+    '''Return the strong checksum of a block'''
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def block_signatures(basis, block) -> bytes:
+    '''Return the signature stream of every whole block of a basis FileSource. The weak
+    checksum is Adler-32, so the sender can roll it one byte at a time'''
+    count = basis.length // block
+    signatures = [SIGNATURE_HEADER.pack(block, count)]
+    for i in range(count):
+        data = basis.segment(i * block, block)
+        signatures.append(SIGNATURE.pack(zlib.adler32(data), strong_checksum(data)))
+    return b"".join(signatures)
+
+class DeltaSource(StreamSource):
+    '''Segment source encoding a FileSource as a delta against the receiver's basis file,
+    from the signatures of its blocks. The file is scanned with a rolling Adler-32 window
+    of one block. The stream is a sequence of records: kind (1) and two values (4 each).
+    A literal record gives its length and is followed by the bytes, and a copy record 
+    gives the first basis block and the number of blocks to copy'''
+
+    RECORD = struct.Struct("!BII")
+
+    def __init__(self, source, signatures) -> None:
+        '''Index the basis blocks by weak then strong checksum'''
+        super().__init__(source)
+        self.block, count = SIGNATURE_HEADER.unpack_from(signatures)
+        self.blocks = dict()
+        for i in range(count):
+            weak, strong = SIGNATURE.unpack_from(signatures, SIGNATURE_HEADER.size + i * SIGNATURE.size)
+            self.blocks.setdefault(weak, dict()).setdefault(strong, i)
+        self.data = source.segment(0, source.size)
+        self.literal = self.input
+        self.run = None
+        self.matched = 0
+        self.read(0)
+
+    def encode(self, length) -> None:
+        '''Scan the file until the buffer holds more than length bytes or the file ends. 
+        Each pass tests windows from the scan position until a block matches, or the 
+        pending literal reaches DELTA_LITERAL bytes. The view of the file is released at
+        its end'''
+        data, block, blocks, end = self.data, self.block, self.blocks, self.source.size
+        while len(self.buffer) <= length and self.input < end:
+            start = self.input
+            if start + block > end:
+                self.__literal(end)
+                break
+            limit = min(end - block, self.literal + DELTA_LITERAL)
+            weak = zlib.adler32(data[start:start + block])
+            a, b, position, index = weak & 0xffff, weak >> 16, start, None
+            if not blocks: position = limit
+            while True:
+                candidates = blocks.get(b << 16 | a)
+                if candidates: index = candidates.get(strong_checksum(data[position:position + block]))
+                if index is not None or position >= limit: break
+                out, new = data[position], data[position + block]
+                a = (a - out + new) % 65521
+                b = (b - block * out + a - 1) % 65521
+                position += 1
+            if index is not None: 
+                self.__literal(position)
+                self.__copy(index)
+            elif limit == end - block: self.__literal(end)
+            else: self.__literal(limit + 1)
+        if self.input < end: return
+        self.__flush_run()
+        self.data.release()
+
+    def __literal(self, stop) -> None:
+        '''Emit the file bytes from the pending literal up to stop'''
+        if stop > self.literal:
+            self.__flush_run()
+            self.emit(self.RECORD.pack(Record.LITERAL, stop - self.literal, 0))
+            self.emit(self.data[self.literal:stop])
+            self.consumed += stop - self.literal
+        self.literal = self.input = stop
+
+    def __copy(self, index) -> None:
+        '''Add a matched block to the pending run of consecutive blocks, up to DELTA_RUN
+        bytes per copy record'''
+        run = self.run
+        if run and run[0] + run[1] == index and (run[1] + 1) * self.block <= DELTA_RUN: run[1] += 1
+        else:
+            self.__flush_run()
+            self.run = [index, 1]
+        self.matched += self.block
+        self.consumed += self.block
+        self.literal = self.input = self.input + self.block
+
+    def __flush_run(self) -> None:
+        '''Emit the pending run of copied blocks'''
+        if self.run: self.emit(self.RECORD.pack(Record.COPY, *self.run))
+        self.run = None
+
+class DeltaDecoder:
+    '''Receiving end of a DeltaSource stream. Literal records are written as they are and
+    copy records are read from the basis FileSource'''
+
+    def __init__(self, basis, block) -> None:
+        '''Initialise with the basis file and its block size'''
+        self.basis = basis
+        self.block = block
+        self.buffer = bytearray()
+        self.written = 0
+        self.copied = 0
+
+    def decode(self, data) -> bytes:
+        '''Return the file data of every record completed by data'''
+        self.buffer += data
+        output, offset, size = list(), 0, DeltaSource.RECORD.size
+        while len(self.buffer) - offset >= size:
+            kind, first, count = DeltaSource.RECORD.unpack_from(self.buffer, offset)
+            if kind == Record.COPY:
+                output.append(bytes(self.basis.segment(first * self.block, count * self.block)))
+                self.copied += len(output[-1])
+                offset += size
+                continue
+            if len(self.buffer) - offset - size < first: break
+            output.append(bytes(self.buffer[offset + size:offset + size + first]))
+            offset += size + first
+        del self.buffer[:offset]
+        output = b"".join(output)
+        self.written += len(output)
+        return output
+
+##################################################################
+# Session Classes
+##################################################################
+
+def open_source(filename) -> FileSource:
+    '''Return a source over a file of a session, read into memory if it is small and 
+    mapped otherwise'''
+    if os.path.getsize(filename) > SESSION_INLINE: return FileSource(filename)
+    with open(filename, "rb") as file: return BufferSource(file.read())
+
+class SessionSource(FileSource):
+    '''Segment source over a sequence of files, so one connection carries them all. Each
+    file is framed as name length (2), file length (8), name, data. Segments run across
+    frame boundaries, and are views of the mapped file where they fall inside one'''
+
+    HEADER = struct.Struct("!HQ")
+    MODE = Session.FILES
+
+    def __init__(self, filenames, names=None) -> None:
+        '''Frame each file under its name, by default its base name. The receiver writes 
+        each file under its name, so names that repeat are refused with ValueError'''
+        self.names, self.files, self.parts, self.bounds, self.frames, self.ends = [], [], [], [], [], []
+        self.started = list()
+        self.next = 0
+        self.offset = 0
+        self.length = self.size = 0
+        names = names or [os.path.basename(i) for i in filenames]
+        repeated = sorted(i for i, count in collections.Counter(names).items() if count > 1)
+        if repeated: raise ValueError(f"{', '.join(repeated)} named more than once in the session")
+        for filename, name in zip(filenames, names):
+            self.add(name, open_source(filename))
+
+    def add(self, name, file) -> None:
+        '''Frame a file source under name at the end of the stream'''
+        self.names.append(name)
+        self.files.append(file)
+        self.frames.append(self.size)
+        self.started.append(None)
+        name = os.fsencode(name)
+        for part in (self.HEADER.pack(len(name), file.length) + name, file.view):
+            if not len(part): continue
+            self.parts.append(part)
+            self.bounds.append(self.size)
+            self.size += len(part)
+        self.ends.append(self.size)
+        self.length = self.size
+
+    def segment(self, offset, length) -> memoryview:
+        '''Return up to length bytes of the stream starting at offset'''
+        pieces, i = list(), bisect.bisect_right(self.bounds, offset) - 1
+        while length > 0 and 0 <= i < len(self.parts):
+            start = offset - self.bounds[i]
+            pieces.append(self.parts[i][start:start + length])
+            offset, length, i = offset + len(pieces[-1]), length - len(pieces[-1]), i + 1
+        return pieces[0] if len(pieces) == 1 else b"".join(pieces)
+
+    def read(self, length) -> memoryview:
+        '''Return the next segment, noting the time the frames starting in it were read'''
+        start = self.offset
+        segment = super().read(length)
+        while self.next < len(self.frames) and self.frames[self.next] < self.offset:
+            if self.frames[self.next] >= start: self.started[self.next] = time.monotonic() * 1000
+            self.next += 1
+        return segment
+
+    def close(self) -> None:
+        '''Close every file source'''
+        for file in self.files: file.close()
+
+class SessionDecoder:
+    '''Receiving end of a SessionSource stream. Each file is written to the FileSink that
+    open_file(name) returns as its data arrives, and closed once complete'''
+
+    def __init__(self, open_file) -> None:
+        '''Initialise before the first frame'''
+        self.open_file = open_file
+        self.buffer = bytearray()
+        self.sink = None
+        self.name = None
+        self.remaining = 0
+        self.position = 0
+        self.files = list()
+        self.written = 0
+
+    def decode(self, data) -> bytes:
+        '''Write the file data in an in order run of the stream. Nothing is left for the
+        connection's own sink, so Data.NONE is returned'''
+        view, offset, size = memoryview(data), 0, SessionSource.HEADER.size
+        while offset < len(view):
+            if self.sink:
+                chunk = view[offset:offset + self.remaining]
+                self.sink.write(self.position, chunk)
+                offset, self.position, self.remaining = offset + len(chunk), \
+                    self.position + len(chunk), self.remaining - len(chunk)
+                if not self.remaining: self.__close()
+                continue
+            chunk = view[offset:offset + self.__header_length() - len(self.buffer)]
+            self.buffer += chunk
+            offset += len(chunk)
+            if len(self.buffer) >= size and len(self.buffer) == self.__header_length(): self.__open()
+        self.written += len(view)
+        return Data.NONE
+
+    def __header_length(self) -> int:
+        '''Return the length of the frame header being read, including the name once its
+        length is known'''
+        size = SessionSource.HEADER.size
+        return size if len(self.buffer) < size else size + UINT16.unpack_from(self.buffer)[0]
+
+    def __open(self) -> None:
+        '''Open the file of a complete frame header'''
+        _, length = SessionSource.HEADER.unpack_from(self.buffer)
+        self.name = os.fsdecode(bytes(self.buffer[SessionSource.HEADER.size:]))
+        self.buffer = bytearray()
+        self.sink, self.remaining, self.position = self.open_file(self.name), length, 0
+        self.sink.allocate(length)
+        if not length: self.__close()
+
+    def __close(self) -> None:
+        '''Close the completed file'''
+        self.sink.close()
+        self.files.append((self.name, self.position))
+        self.sink = None
+
+##################################################################
+# File Sink Class
+##################################################################
+
+class FileSink:
+    '''Offset-addressed output file. Segments are written straight to their offsets with
+    pwrite, so arrival order does not matter and no segment is held in memory'''
+
+    def __init__(self, filename) -> None:
+        '''Open the file for writing without truncating it, so several receivers can 
+        write their own ranges of one file'''
+        self.fd = os.open(filename, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        self.size = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def allocate(self, size) -> None:
+        '''Set the file to size bytes, reserving its blocks where the platform allows'''
+        self.size = size
+        os.ftruncate(self.fd, size)
+        if not size or not hasattr(os, "posix_fallocate"): return
+        try: os.posix_fallocate(self.fd, 0, size)
+        except OSError: pass
+
+    def length(self) -> int:
+        '''Return the current size of the file'''
+        return os.fstat(self.fd).st_size
+
+    def write(self, offset, data) -> None:
+        '''Write data at offset'''
+        view = memoryview(data)
+        while view:
+            if hasattr(os, "pwrite"): written = os.pwrite(self.fd, view, offset)
+            else:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                written = os.write(self.fd, view)
+            view, offset = view[written:], offset + written
+
+    def sync(self) -> None:
+        '''Flush the data written so far to disk'''
+        if hasattr(os, "fdatasync"): os.fdatasync(self.fd)
+        else: os.fsync(self.fd)
+
+    def close(self) -> None:
+        '''Close the file'''
+        os.close(self.fd)
+
+class BufferSink(FileSink):
+    '''Offset-addressed output buffer in memory'''
+
+    def __init__(self) -> None:
+        '''Start with an empty buffer'''
+        self.buffer = bytearray()
+        self.size = None
+
+    def allocate(self, size) -> None:
+        '''Set the buffer to size bytes'''
+        self.size = size
+        self.buffer = bytearray(size)
+
+    def length(self) -> int:
+        '''Return the current size of the buffer'''
+        return len(self.buffer)
+
+    def write(self, offset, data) -> None:
+        '''Write data at offset'''
+        self.buffer[offset:offset + len(data)] = data
+
+    def sync(self) -> None:
+        '''Nothing to flush'''
+        pass
+
+    def close(self) -> None:
+        '''Nothing to close'''
+        pass
+
+##################################################################
+# Directory Tree Classes
+##################################################################
+
+# Manifest entry: path length, size, mode and modification time in nanoseconds, then the
+# path. The manifest is the deflated sequence of entries
+MANIFEST_ENTRY = struct.Struct("!HQIQ")
+
+def walk_manifest(root) -> list:
+    '''Return (path, size, mode, mtime_ns) of every directory and regular file below root,
+    parents first. Paths are relative to root and "/" separated. Other files, such as
+    symbolic links, are left out'''
+    entries = list()
+    for top, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in dirs + sorted(files):
+            info = os.lstat(os.path.join(top, name))
+            if not stat.S_ISDIR(info.st_mode) and not stat.S_ISREG(info.st_mode): continue
+            path = os.path.relpath(os.path.join(top, name), root).replace(os.sep, "/")
+            size = info.st_size if stat.S_ISREG(info.st_mode) else 0
+            entries.append((path, size, info.st_mode, info.st_mtime_ns))
+    return entries
+
+def pack_manifest(entries) -> bytes:
+    '''Serialise manifest entries'''
+    paths = [os.fsencode(i[0]) for i in entries]
+    return zlib.compress(b"".join(MANIFEST_ENTRY.pack(len(path), *entry[1:]) + path
+        for path, entry in zip(paths, entries)))
+
+def unpack_manifest(data) -> list:
+    '''Parse a manifest into (path, size, mode, mtime_ns) entries'''
+    data, entries, offset = zlib.decompress(data), list(), 0
+    while offset < len(data):
+        length, size, mode, mtime = MANIFEST_ENTRY.unpack_from(data, offset)
+        offset += MANIFEST_ENTRY.size
+        entries.append((os.fsdecode(data[offset:offset + length]), size, mode, mtime))
+        offset += length
+    return entries
+
+def tree_path(root, path) -> str:
+    '''Return the local path of a manifest path below root. Paths that could leave root
+    are refused with ValueError'''
+    parts = path.split("/")
+    if path.startswith("/") or any(i in ("", ".", "..") or os.sep in i for i in parts):
+        raise ValueError(f"{path} is not a path below the tree")
+    return os.path.join(root, *parts)
+
+class TreeSource(SessionSource):
+    '''Session over a directory tree. The first frame, named "", is the manifest of the
+    tree. The files the receiver's manifest does not show with the same size and
+    modification time follow, small files first so they share segments, then the large
+    files back to back'''
+
+    MODE = Session.TREE
+
+    def __init__(self, root) -> None:
+        '''Walk the tree. Nothing is framed until the receiver's manifest is known'''
+        super().__init__([])
+        self.root = root
+        self.manifest = walk_manifest(root)
+        self.skipped = list()
+
+    def plan(self, remote) -> None:
+        '''Frame the manifest and the files that differ from the receiver's manifest'''
+        held = { i[0]: (i[1], i[3]) for i in unpack_manifest(remote) if stat.S_ISREG(i[2]) }
+        self.add("", BufferSource(pack_manifest(self.manifest)))
+        files = [i for i in self.manifest if stat.S_ISREG(i[2])]
+        for path, size, mode, mtime in sorted(files, key=lambda i: i[1] > SESSION_INLINE):
+            if held.get(path) == (size, mtime): self.skipped.append(path)
+            else: self.add(path, open_source(tree_path(self.root, path)))
+
+class TreeSink:
+    '''Receiving end of a TreeSource session. Files are written below root by their paths,
+    and once the session ends the sender's manifest, its first frame, gives every entry
+    its mode and modification time'''
+
+    def __init__(self, root) -> None:
+        '''Write the tree below root, created if missing'''
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.manifest = None
+        self.files = 0
+        self.skipped = 0
+
+    def local_manifest(self) -> bytes:
+        '''Return the manifest of the tree held here'''
+        return pack_manifest(walk_manifest(self.root))
+
+    def open_file(self, name) -> FileSink:
+        '''Return the sink of a session frame: a buffer for the manifest, or the file at
+        its path with its parent directories created. A file left by an earlier sync is
+        replaced, not opened, as its mode may not allow writing'''
+        if not name:
+            self.manifest = BufferSink()
+            return self.manifest
+        path = tree_path(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.lexists(path) and not os.path.isdir(path): os.unlink(path)
+        self.files += 1
+        return FileSink(path)
+
+    def finish(self) -> None:
+        '''Create the directories of the sender's manifest and set the mode and modification
+        time of every entry. Directories come last and deepest first, as writing into a
+        directory changes its modification time'''
+        if not self.manifest: return
+        entries = unpack_manifest(self.manifest.buffer)
+        for path, _, mode, _ in entries:
+            if stat.S_ISDIR(mode): os.makedirs(tree_path(self.root, path), exist_ok=True)
+        files = [i for i in entries if not stat.S_ISDIR(i[2])]
+        for path, _, mode, mtime in files + [i for i in reversed(entries) if stat.S_ISDIR(i[2])]:
+            os.chmod(tree_path(self.root, path), stat.S_IMODE(mode))
+            os.utime(tree_path(self.root, path), ns=(mtime, mtime))
+        self.skipped = len(files) - self.files
+
+##################################################################
+# Checkpoints
+##################################################################
+
+def file_identity(filename) -> bytes:
+    '''Return a digest of the name, size and modification time of a file, which changes
+    whenever a new version of the file is sent'''
+    info = os.stat(filename)
+    name = f"{os.path.basename(filename)}:{info.st_size}:{info.st_mtime_ns}"
+    return hashlib.blake2b(name.encode(), digest_size=16).digest()
+
+def read_checkpoint(path) -> dict:
+    '''Return the saved state of a transfer, or None if there is none'''
+    try:
+        with open(path) as file: return json.load(file)
+    except (OSError, ValueError): return None
+
+def write_checkpoint(path, state) -> None:
+    '''Save the state of a transfer, replacing the old checkpoint atomically'''
+    with open(path + ".tmp", "w") as file: json.dump(state, file)
+    os.replace(path + ".tmp", path)
+
+##################################################################
+# Connection Tokens
+##################################################################
+
+def token_secret(path) -> bytes:
+    '''Return the receiver's secret for connection tokens kept at path, created on first
+    use, so tokens stay valid across restarts'''
+    try:
+        with open(path, "rb") as file: return file.read()
+    except OSError: pass
+    secret = os.urandom(16)
+    with open(path, "wb") as file: file.write(secret)
+    return secret
+
+def read_token(path, peer) -> bytes:
+    '''Return the connection token cached for peer, or b"" to ask for one'''
+    return bytes.fromhex((read_checkpoint(path) or dict()).get(peer, ""))
+
+def write_token(path, peer, token) -> None:
+    '''Cache the connection token of peer'''
+    tokens = read_checkpoint(path) or dict()
+    tokens[peer] = token.hex()
+    write_checkpoint(path, tokens)
+
+##################################################################
+# UDP Receive Offload
+##################################################################
+
+def enable_udp_gro(sock) -> bool:
+    '''Turn on UDP GRO for sock on Linux. Return whether the kernel accepted the option'''
+    if not sys.platform.startswith("linux"): return False
+    try: sock.setsockopt(socket.SOL_UDP, UDP_GRO, 1)
+    except OSError: return False
+    return True
+
+def recv_datagrams(sock, gro) -> tuple:
+    '''Read from sock and return its datagrams, in order, and the peer address. With GRO
+    a coalesced burst is split by its segment size'''
+    if not gro:
+        msg, addr = sock.recvfrom(MAX_SEG_SIZE)
+        return [msg], addr
+    msg, ancdata, _, addr = sock.recvmsg(MAX_SEG_SIZE, socket.CMSG_SPACE(4))
+    size = next((struct.unpack("=i", data[:4])[0] for level, kind, data in ancdata 
+        if level == socket.SOL_UDP and kind == UDP_GRO), len(msg))
+    return [msg[i:i + size] for i in range(0, len(msg), size)] if size else [msg], addr
+
+##################################################################
+# Commandline Options
+##################################################################
+
+def parse_options(argv, options) -> list:
+    '''Move "--name value" arguments into the options dict, converting each value to 
+    the type of its default. Boolean options are flags. Return the positional arguments
+    or None if an option is unknown or malformed'''
+    args, argv = list(), iter(argv)
+    for arg in argv:
+        if not arg.startswith("--"): 
+            args.append(arg)
+            continue
+        name = arg[2:].replace("-", "_")
+        if name not in options: return None
+        if isinstance(options[name], bool): 
+            options[name] = True
+            continue
+        try: options[name] = type(options[name])(next(argv))
+        except (StopIteration, ValueError): return None
+    return args
+
+##################################################################
+# Trace Buffer Class
+##################################################################
+
+class TraceBuffer:
+    '''Preallocated buffer of fixed-size binary packet records: event, monotonic ns 
+    timestamp, packet type, seq, ack and length. In memory it is a ring keeping the latest
+    records. Streamed to a file, each full chunk is written by a background thread'''
+
+    RECORD = struct.Struct("<BqBQQI")
+    MAGIC = b"PTP2"
+    FILE_HEADER = struct.Struct("<4sq")
+    EVENTS = (Action.SEND, Action.RECEIVE, Action.DROP, Action.RECOVER)
+    EVENT_CODES = { j: i for i, j in enumerate(EVENTS) }
+    TYPE_CODES = BinaryCodec.CODES
+
+    def __init__(self, level=Trace.FULL, records=TRACE_RECORDS) -> None:
+        '''Initialise an empty buffer. Below the full level no records are kept, only the
+        times of the first and last packet'''
+        self.level = level
+        self.epoch = time.monotonic_ns()
+        self.records = records
+        self.buffer = bytearray(records * self.RECORD.size) if level == Trace.FULL else None
+        self.index = 0
+        self.wrapped = False
+        self.count = 0
+        self.first = self.last = None
+        self.path = None
+        self.file = None
+        self.queue = None
+        self.thread = None
+
+    def stream(self, path) -> None:
+        '''Write every record to a binary trace file instead of keeping the latest'''
+        if self.level != Trace.FULL: return
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(self.FILE_HEADER.pack(self.MAGIC, self.epoch))
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.__flush, daemon=True)
+        self.thread.start()
+
+    def add(self, action, packet_type, seq, ack, length) -> None:
+        '''Record a packet event'''
+        if self.level == Trace.OFF: return
+        now = time.monotonic_ns()
+        if self.first is None: self.first = now
+        self.last = now
+        if self.level != Trace.FULL: return
+        self.RECORD.pack_into(self.buffer, self.index * self.RECORD.size, 
+            self.EVENT_CODES[action], now, self.TYPE_CODES[packet_type], seq, ack, length)
+        self.count += 1
+        self.index += 1
+        if self.index < self.records: return
+        self.index = 0
+        if self.file: 
+            self.queue.put(self.buffer)
+            self.buffer = bytearray(self.records * self.RECORD.size)
+        else: self.wrapped = True
+
+    def __flush(self) -> None:
+        '''Write chunks to the trace file until the end marker'''
+        chunk = self.queue.get()
+        while chunk is not None:
+            self.file.write(chunk)
+            chunk = self.queue.get()
+
+    def close(self) -> None:
+        '''Write any partial chunk and close the trace file'''
+        if not self.file: return
+        self.queue.put(self.buffer[:self.index * self.RECORD.size])
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        self.file = None
+        self.index = 0
+
+    def dropped(self) -> int:
+        '''Return the number of records overwritten in the ring'''
+        return self.count - self.records if self.wrapped else 0
+
+    def __iter__(self):
+        '''Yield records held in memory, oldest first'''
+        if not self.buffer: return
+        size = self.RECORD.size
+        if self.wrapped: yield from self.RECORD.iter_unpack(self.buffer[self.index * size:])
+        yield from self.RECORD.iter_unpack(self.buffer[:self.index * size])
+
+def read_trace(path) -> tuple:
+    '''Return the epoch and an iterator over the records of a binary trace file'''
+    with open(path, "rb") as file: data = file.read()
+    magic, epoch = TraceBuffer.FILE_HEADER.unpack_from(data)
+    if magic != TraceBuffer.MAGIC: raise ValueError(f"{path} is not a trace file")
+    return epoch, TraceBuffer.RECORD.iter_unpack(memoryview(data)[TraceBuffer.FILE_HEADER.size:])
+
+def trace_rows(epoch, records) -> list:
+    '''Render binary records as log rows: action, ms since epoch, type, seq, ack, length'''
+    return [[TraceBuffer.EVENTS[a], round((b - epoch) / 1e6, 3), BinaryCodec.TYPES[c], d, e, f] 
+        for a, b, c, d, e, f in records]
+
+##################################################################
+# Log Files
+##################################################################
+
+def write_rows(logfile, rows) -> None:
+    '''Write log rows in the text log format'''
+    for a, b, c, d, e, f in rows:
+        logfile.write(f"{a:<5} {b:<12} {c:<4} {d:<8} {f:<6} {e:<6}\n")
+
+def write_trace_rows(logfile, tcp) -> None:
+    '''Write a connection's packet log rows, or where its trace went instead'''
+    trace = tcp.trace
+    if trace.level != Trace.FULL: return
+    trace.close()
+    if trace.path: 
+        return logfile.write(f"Packet trace streamed to {trace.path}, convert it with trace.py\n")
+    if trace.dropped(): logfile.write(f"... {trace.dropped()} earlier records overwritten\n")
+    write_rows(logfile, tcp.get_log())
+
+def percentile(values, fraction) -> float:
+    '''Return the value at a fraction, between 0 and 1, of the way through the sorted values'''
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0
+
+def write_sender_log(sender, path) -> None:
+    '''Write a sender's packet log, congestion window samples and statistics'''
+    with open(path, "w") as logfile:
+        write_trace_rows(logfile, sender)
+        if sender.cwnd_log: 
+            logfile.write(f"\n--------- Congestion Window ({sender.cc.NAME}) ---------\n\n")
+        for a, b, c in sender.cwnd_log: logfile.write(f"{a:<12} {b:<12.0f} {c:<12.0f}\n")
+        tot_data, num_seg, drp_pkt, re_seg, dup_ack, rto_exp, fast_re, sack_re, re_bytes, sacked, \
+            sys_snd, probes, fec_sent = sender.get_stats()
+        if sender.pacer and sender.pacer.log:
+            logfile.write("\n--------- Pacing Rate (bytes/s) ---------\n\n")
+            for a, b in sender.pacer.log: logfile.write(f"{a:<12} {b:<12.0f}\n")
+        if sender.latencies:
+            logfile.write("\n--------- File Latency (ms) ---------\n\n")
+            for a, b, c in sender.latencies: logfile.write(f"{a or '(manifest)':<40} {b:<12} {c:<12.3f}\n")
+        logfile.write("\n--------- Log File Statistics ---------\n\n")
+        logfile.write(f"Total Data Transferred (bytes):  {tot_data}\n")
+        logfile.write(f"No. Data Segments Sent:          {num_seg}\n")
+        logfile.write(f"No. Packets Dropped:             {drp_pkt}\n")
+        logfile.write(f"No. Retransmitted Segments:      {re_seg}\n")
+        logfile.write(f"  - After Timeout:               {rto_exp}\n")
+        logfile.write(f"  - Fast Retransmit:             {fast_re}\n")
+        logfile.write(f"  - SACK Hole Repair:            {sack_re}\n")
+        logfile.write(f"Retransmitted Data (bytes):      {re_bytes}\n")
+        logfile.write(f"No. SACKed Segments:             {sacked}\n")
+        logfile.write(f"No. Duplicate Acknowledgements:  {dup_ack}\n")
+        logfile.write(f"No. Send System Calls:           {sys_snd}\n")
+        logfile.write(f"No. Zero Window Probes:          {probes}\n")
+        logfile.write(f"No. FEC Parity Segments Sent:    {fec_sent}\n")
+        logfile.write(f"Negotiated MSS / Window (bytes): {sender.mss} / {sender.max_window}\n")
+        logfile.write(f"Resumed From (bytes):            {sender.resume}\n")
+        if sender.pacer: 
+            logfile.write(f"Final Pacing Rate (Mbit/s):      {sender.pacer.rate * 8 / 1e6:.3f}\n")
+        if sender.token is not None:
+            logfile.write(f"0-RTT Data Accepted (bytes):     {sender.early}\n")
+        if sender.latencies:
+            latencies = [i[2] for i in sender.latencies]
+            logfile.write(f"No. Session Files Sent:          {len(latencies)}\n")
+            logfile.write(f"File Latency Min / Median (ms):  {min(latencies):.3f} / {percentile(latencies, 0.5):.3f}\n")
+            logfile.write(f"File Latency p90 / p99 (ms):     {percentile(latencies, 0.9):.3f} / {percentile(latencies, 0.99):.3f}\n")
+            logfile.write(f"File Latency Max / Mean (ms):    {max(latencies):.3f} / {sum(latencies) / len(latencies):.3f}\n")
+        if sender.remote is not None:
+            logfile.write(f"Files Sent / Skipped Identical:  {len(sender.session.files) - 1} / {len(sender.session.skipped)}\n")
+            logfile.write(f"Manifest Out / In (bytes):       {sender.session.files[0].length} / {len(sender.remote)}\n")
+        source = sender.compressed or sender.delta
+        if sender.compressed: 
+            logfile.write(f"File / Compressed Data (bytes):  {source.consumed} / {source.produced}\n")
+            logfile.write(f"Compression Ratio / Final Level: {source.ratio():.3f} / {source.level}\n")
+        if sender.delta:
+            saved = source.consumed - source.produced - len(sender.signatures)
+            logfile.write(f"File / Delta Data (bytes):       {source.consumed} / {source.produced}\n")
+            logfile.write(f"Matched / Signature (bytes):     {source.matched} / {len(sender.signatures)}\n")
+            logfile.write(f"Bytes Saved vs Full Transfer:    {saved}\n")
+        if sender.trace.first is not None:
+            seconds = max(sender.trace.last - sender.trace.first, 1) / 1e9
+            goodput = (source.consumed if source else tot_data) * 8 / seconds / 1e6
+            logfile.write(f"Transfer Time (s):               {seconds:.6f}\n")
+            logfile.write(f"Effective Goodput (Mbit/s):      {goodput:.3f}\n")
+        logfile.write(f"Smoothed RTT / Final RTO (ms):   {sender.rto.srtt or 0:.3f} / {sender.rto.get_rto():.3f}\n\n")
+
+def write_receiver_log(receiver, path) -> None:
+    '''Write a receiver's packet log and statistics'''
+    with open(path, "w") as logfile:
+        write_trace_rows(logfile, receiver)
+        tot_data, num_seg, num_dup, num_ack, sys_rcv, num_ovf, num_par, num_fec = receiver.get_stats()
+        logfile.write("\n--------- Log File Statistics ---------\n\n")
+        logfile.write(f"Total Data Received (bytes):     {tot_data}\n")
+        logfile.write(f"No. Data Segments Received:      {num_seg}\n")
+        logfile.write(f"No. Duplicate Segments:          {num_dup}\n")
+        logfile.write(f"No. Segments Beyond Window:      {num_ovf}\n")
+        logfile.write(f"No. FEC Parity Segments:         {num_par}\n")
+        logfile.write(f"No. Segments Recovered by FEC:   {num_fec}\n")
+        logfile.write(f"No. Acknowledgements Sent:       {num_ack}\n")
+        logfile.write(f"ACK-to-Data Ratio:               {num_ack / max(num_seg + num_dup, 1):.3f}\n")
+        logfile.write(f"No. Receive System Calls:        {sys_rcv}\n")
+        if receiver.decoder: 
+            logfile.write(f"Decoded Data (bytes):            {receiver.decoder.written}\n")
+        if receiver.secret:
+            logfile.write(f"0-RTT Data Accepted (bytes):     {receiver.early}\n")
+        if isinstance(receiver.decoder, SessionDecoder):
+            logfile.write(f"No. Session Files Received:      {len(receiver.decoder.files)}\n")
+        if receiver.tree:
+            logfile.write(f"Files Received / Skipped:        {receiver.tree.files} / {receiver.tree.skipped}\n")
+            logfile.write(f"Manifest Sent (bytes):           {receiver.manifest_bytes}\n")
+        if receiver.signature_bytes:
+            logfile.write(f"Copied / Signature (bytes):      {receiver.decoder.copied} / {receiver.signature_bytes}\n")
+        logfile.write(f"Resumed From (bytes):            {receiver.resumed}\n")
+        logfile.write(f"Negotiated MSS / Window (bytes): {receiver.mss} / {receiver.max_window}\n\n")
+
+##################################################################
+# Retransmission Timer Class
+##################################################################
+
+class RTOEstimator:
+    '''Jacobson/Karels retransmission timeout estimator (RFC 6298) in milliseconds'''
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self, initial=INITIAL_RTO, minimum=MIN_RTO, maximum=MAX_RTO) -> None:
+        '''Initialise estimator with no RTT samples'''
+        self.srtt = None
+        self.rttvar = None
+        self.minimum = minimum
+        self.maximum = maximum
+        self.base = initial
+        self.backoff = 1
+
+    def sample(self, rtt) -> None:
+        '''Smooth a new RTT sample into SRTT/RTTVAR and clear any backoff'''
+        if self.srtt is None: self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.base = self.srtt + self.K * self.rttvar
+        self.backoff = 1
+
+    def reset_backoff(self) -> None:
+        '''Clear backoff once new data is acknowledged, as QUIC does (RFC 9002). Under 
+        heavy loss Karn's rule may never yield a sample to clear it otherwise'''
+        self.backoff = 1
+
+    def timeout(self) -> None:
+        '''Double the timeout after the timer expires'''
+        if self.get_rto() < self.maximum: self.backoff *= 2
+
+    def get_rto(self) -> float:
+        '''Return the current clamped and backed off timeout'''
+        return min(max(self.base, self.minimum) * self.backoff, self.maximum)
+
+##################################################################
+# Congestion Control Classes
+##################################################################
+
+class CongestionControl:
+    '''No congestion control: the window is limited by MWS alone. Subclasses share
+    NewReno fast recovery (RFC 6582) and implement window growth and reduction. 
+    Windows are in bytes and times in seconds'''
+
+    NAME = "none"
+
+    def __init__(self, mss) -> None:
+        '''Initialise an unlimited window'''
+        self.mss = mss
+        self.cwnd = float("inf")
+        self.ssthresh = float("inf")
+
+    def on_ack(self, acked, now, rtt) -> None:
+        '''New data acknowledged outside fast recovery: slow start or congestion avoidance'''
+        if self.cwnd < self.ssthresh: self.cwnd += acked
+        else: self.congestion_avoidance(acked, now, rtt)
+
+    def on_loss(self, flight, now) -> None:
+        '''Fast retransmit: reduce the window and inflate it by the three duplicates'''
+        self.ssthresh = self.reduce(flight)
+        self.cwnd = self.ssthresh + DUP_ACK_THRESHOLD * self.mss
+
+    def on_dup_ack(self) -> None:
+        '''Inflate the window during fast recovery as each duplicate left the network'''
+        self.cwnd += self.mss
+
+    def on_partial_ack(self, acked) -> None:
+        '''Deflate by the data acknowledged and add back one segment'''
+        self.cwnd = max(self.cwnd - acked + self.mss, self.mss)
+
+    def on_recovery_exit(self) -> None:
+        '''Deflate the window when fast recovery completes'''
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self, flight, now) -> None:
+        '''Retransmission timeout: restart slow start from one segment'''
+        self.ssthresh = self.reduce(flight)
+        self.cwnd = self.mss
+
+    def congestion_avoidance(self, acked, now, rtt) -> None:
+        '''Grow the window once past ssthresh'''
+        pass
+
+    def reduce(self, flight) -> float:
+        '''Return the new ssthresh after a loss'''
+        return self.ssthresh
+
+class Reno(CongestionControl):
+    '''TCP Reno: additive increase of one segment per RTT, halve on loss (RFC 5681)'''
+
+    NAME = "reno"
+
+    def __init__(self, mss) -> None:
+        '''Initialise with the standard initial window'''
+        super().__init__(mss)
+        self.cwnd = INITIAL_CWND * mss
+
+    def congestion_avoidance(self, acked, now, rtt) -> None:
+        '''Add one segment per window of data acknowledged'''
+        self.cwnd += self.mss * acked / self.cwnd
+
+    def reduce(self, flight) -> float:
+        '''Halve the data in flight'''
+        return max(flight / 2, 2 * self.mss)
+
+class Cubic(Reno):
+    '''CUBIC (RFC 9438): window grows as a cubic function of time since the last loss,
+    with a Reno-friendly lower bound'''
+
+    NAME = "cubic"
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, mss) -> None:
+        '''Initialise with no congestion epoch'''
+        super().__init__(mss)
+        self.w_max = 0
+        self.w_est = 0
+        self.k = 0
+        self.epoch = None
+
+    def congestion_avoidance(self, acked, now, rtt) -> None:
+        '''Move the window towards the cubic target one RTT ahead'''
+        if self.epoch is None:
+            self.epoch, self.w_est = now, self.cwnd
+            self.k = (max(self.w_max - self.cwnd, 0) / self.mss / self.C) ** (1 / 3)
+        t = now - self.epoch + rtt
+        target = self.w_max + self.mss * self.C * (t - self.k) ** 3
+        target = min(max(target, self.cwnd), 1.5 * self.cwnd)
+        self.w_est += self.mss * 3 * (1 - self.BETA) / (1 + self.BETA) * acked / self.cwnd
+        self.cwnd = max(self.cwnd + acked * (target - self.cwnd) / self.cwnd, self.w_est)
+
+    def reduce(self, flight) -> float:
+        '''Remember the window at loss, with fast convergence, and back off by BETA'''
+        self.epoch = None
+        self.w_max = self.cwnd * (1 + self.BETA) / 2 if self.cwnd < self.w_max else self.cwnd
+        return max(self.cwnd * self.BETA, 2 * self.mss)
+
+# Available congestion controllers by commandline name
+CONGESTION_CONTROLS = { i.NAME: i for i in (CongestionControl, Reno, Cubic) }
+
+##################################################################
+# Pacer Class
+##################################################################
+
+class Pacer:
+    '''Token bucket spreading new data segments at a pacing rate, instead of sending each
+    window opening as one burst. The rate is fixed, or derived from cwnd / SRTT once both
+    are known. Rates are in bytes per second and times in seconds'''
+
+    def __init__(self, rate=0) -> None:
+        '''Pace at a fixed rate, or from cwnd / SRTT if rate is 0. Until a rate is known
+        segments are not paced'''
+        self.fixed = rate
+        self.rate = rate
+        self.tokens = 0
+        self.stamp = None
+        self.log = collections.deque(maxlen=TRACE_SAMPLES)
+
+    def update(self, cc, recovering, srtt, now, log=True) -> None:
+        '''Derive the rate from the congestion window and smoothed RTT in milliseconds,
+        with a higher gain in slow start so the window can still grow. In recovery the 
+        window is inflated by duplicate acks, which clock the sending instead, so pacing
+        pauses. With log, changes of over 1% are kept against now in a bounded log'''
+        if self.fixed or not srtt or cc.cwnd == float("inf"): return
+        gain = PACING_GAIN_SS if cc.cwnd < cc.ssthresh else PACING_GAIN_CA
+        rate = 0 if recovering else gain * cc.cwnd / (srtt / 1000)
+        if log and (abs(rate - self.rate) > self.rate / 100 or not rate): self.log.append((now, rate))
+        self.rate = rate
+
+    def __refill(self, mss, now) -> None:
+        '''Add the tokens earned since the last refill, up to one quantum of data'''
+        burst = max(self.rate * PACING_QUANTUM, 2 * mss)
+        if self.stamp is None: self.tokens = burst
+        else: self.tokens = min(burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait(self, mss, now) -> float:
+        '''Return seconds until a segment of mss bytes may be sent'''
+        if not self.rate: return 0
+        self.__refill(mss, now)
+        return max(mss - self.tokens, 0) / self.rate
+
+    def consume(self, size) -> None:
+        '''Take the tokens for a segment that was sent'''
+        if self.rate: self.tokens -= size
+
 ##################################################################
 # TCP Class
 ##################################################################
 
 class TCP:
-    def __init__(self, seq, ack) -> None:
+    def __init__(self, seq, ack, codec=None) -> None:
         '''Initialise TCP instance'''
-        self.log = list()
-        self.epoch = time.time()
+        self.codec = codec if codec else BinaryCodec()
+        self.cid = 0
+        self.trace = TraceBuffer()
         self.seq = seq
         self.ack = ack
         self.stats = None
 
     def get_time(self) -> float:
-        '''Get the time since start of program'''
-        return round((time.time() - self.epoch) * 1000, 3)
+        '''Get the time in milliseconds since the trace began'''
+        return round((time.monotonic_ns() - self.trace.epoch) / 1e6, 3)
 
-    def encode(self, seq, ack, data, packet_type) -> bytes:
-        '''Jsonify and encode packet'''
-        return json.dumps({ "seq": seq, "ack": ack, "data": data, "p_type": packet_type }).encode()
+    def clock(self) -> float:
+        '''Get monotonic time in milliseconds for timers'''
+        return time.monotonic() * 1000
 
-    def decode(self, packet) -> set:
-        '''Decode and extract data from jsonified packet'''
-        return json.loads(packet.decode()).values()
+    def encode(self, seq, ack, data, packet_type, options=b"") -> bytes:
+        '''Serialise packet with the connection's codec and id'''
+        return self.codec.encode(seq, ack, data, packet_type, options, self.cid)
+
+    def decode(self, packet) -> tuple:
+        '''Deserialise packet with the connection's codec'''
+        return self.codec.decode(packet)
+
+    def set_trace(self, level, path=None) -> None:
+        '''Trace packets at level off, stats or full, streaming full traces to path'''
+        self.trace = TraceBuffer(level)
+        if path: self.trace.stream(path)
 
     def add_log(self, action, seq, ack, data, packet_type) -> None:
         '''Log packet information'''
-        self.log.append([action, self.get_time(), packet_type, seq, ack, len(data)])
+        self.trace.add(action, packet_type, seq, ack, len(data))
 
     def get_log(self) -> list:
-        '''Return log'''
-        return self.log
+        '''Return the packet log rows held in memory'''
+        return trace_rows(self.trace.epoch, self.trace)
 
     def header_bytes(self) -> tuple:
         '''Return a tuple of packet types that consume a byte'''
@@ -96,56 +1551,463 @@ class TCP:
 
 class Sender(TCP):
 
-    def __init__(self, client, seq, ack, window_length, addr) -> None:
+    def __init__(self, client, seq, ack, window_length, addr, codec=None) -> None:
         '''Initialise Sender instance'''
-        super().__init__(seq, ack)
+        super().__init__(seq, ack, codec)
+        self.cid = int.from_bytes(os.urandom(2), "big")
         self.client = client
         self.addr = addr
+        self.gso = False
+        self.batch = list()
+        self.syn_options = dict()
+        self.mss = None
+        self.max_window = None
+        self.features = FEATURES
+        self.peer_edge = None
+        self.fec = 0
+        self.parity = [None, 0, 0]
+        self.compression = None
+        self.compressed = None
+        self.resume = 0
+        self.signatures = None
+        self.delta = None
+        self.session = None
+        self.remote = None
+        self.latencies = list()
+        self.token = None
+        self.early = 0
+        self.opened = None
+        self.stream_start = None
+        self.random = random.Random()
+        self.pdrop = 0
+        self.pacer = None
         self.window = SenderWindow(window_length)
-        self.stats = { "tot_data": 0, "num_seg": 0, "drp_pkt": 0, "re_seg": 0, "dup_ack": 0 }
+        self.rto = RTOEstimator()
+        self.cc = CongestionControl(1)
+        self.cwnd_log = collections.deque(maxlen=TRACE_SAMPLES)
+        self.timer_start = 0
+        self.dup_acks = 0
+        self.recovery = Recovery.NONE
+        self.recover = seq
+        self.rexmit_next = seq
+        self.high_sack = seq
+        self.stats = { "tot_data": 0, "num_seg": 0, "drp_pkt": 0, "re_seg": 0, "dup_ack": 0, 
+            "rto_exp": 0, "fast_re": 0, "sack_re": 0, "re_bytes": 0, "sacked": 0, "sys_snd": 0,
+            "probes": 0, "fec_sent": 0 }
+
+    def enable_gso(self) -> bool:
+        '''Batch data packets into UDP GSO trains on Linux. Return whether the kernel 
+        accepted the option'''
+        if not sys.platform.startswith("linux"): return False
+        try: self.client.setsockopt(socket.SOL_UDP, UDP_SEGMENT, 0)
+        except OSError: return False
+        self.gso = True
+        return True
+
+    def flush(self) -> None:
+        '''Send the batched packets as one GSO train. Falls back to one packet per
+        datagram if the kernel rejects the train'''
+        if not self.batch: return
+        batch, self.batch = self.batch, list()
+        if len(batch) > 1:
+            try:
+                self.client.sendmsg([b"".join(batch)], 
+                    [(socket.SOL_UDP, UDP_SEGMENT, struct.pack("=H", len(batch[0])))], 0, self.addr)
+                self.stats["sys_snd"] += 1
+                return
+            except OSError: self.gso = False
+        for packet in batch: self.__sendto(packet)
+
+    def __transmit(self, packet, handshake=False) -> None:
+        '''Send packet now, or add it to the GSO batch. Every packet in a train but the 
+        last must be the same size as the first'''
+        if not self.gso or handshake:
+            self.flush()
+            return self.__sendto(packet)
+        batch = self.batch
+        if batch and (len(packet) > len(batch[0]) or len(batch[-1]) != len(batch[0]) 
+                or len(batch) == GSO_MAX_SEGMENTS or len(batch[0]) * (len(batch) + 1) > GSO_MAX_BYTES): 
+            self.flush()
+        self.batch.append(packet)
+
+    def __sendto(self, packet) -> None:
+        '''Send a single datagram'''
+        self.client.sendto(packet, self.addr)
+        self.stats["sys_snd"] += 1
 
     def send(self, data, packet_type, handshake=False) -> None:
         '''Encode data and add to current window. Logs and sends the packet'''
-        self.client.sendto(self.encode(self.seq, self.ack, data, packet_type), self.addr)
+        options = pack_options(self.syn_options) if packet_type == Packet.SYN else b""
+        self.__transmit(self.encode(self.seq, self.ack, data, packet_type, options), handshake)
         self.add_log(Action.SEND, self.seq, self.ack, data, packet_type)
         self.__update_seq(data, packet_type)
-        if not handshake: self.window.add(self.seq, self.ack, data)
+        if not handshake: self.window.add(self.seq, self.ack, data, self.clock())
         self.stats["tot_data"] += len(data)
         if packet_type == Packet.DATA: self.stats["num_seg"] += 1
 
-    def resend(self, seq, ack, data, packet_type) -> None:
-        '''Log and send the data as a packet without adding to window'''
-        self.client.sendto(self.encode(seq, ack, data, packet_type), self.addr)
+    def resend(self, slot, packet_type) -> None:
+        '''Log and send a window slot's data again, restarting its timer'''
+        seq, ack, data = slot[0] - len(slot[2]), slot[1], slot[2]
+        self.__transmit(self.encode(seq, ack, data, packet_type))
         self.add_log(Action.SEND, seq, ack, data, packet_type)
+        self.window.retransmitted(slot, self.clock())
         self.stats["re_seg"] += 1
+        self.stats["re_bytes"] += len(data)
 
-    def receive(self, handshake=False) -> None:
-        '''Log data with current sequence and ack number. Drops the packet'''
+    def receive(self, handshake=False, expect=None) -> None:
+        '''Receive a packet from the socket and handle it. While waiting for a handshake
+        reply of type expect, anything else is skipped'''
         msg, _ = self.client.recvfrom(MAX_SEG_SIZE)
-        seq, ack, data, packet_type = self.decode(msg)
+        while expect and not self.accepts(msg, expect): msg, _ = self.client.recvfrom(MAX_SEG_SIZE)
+        if self.accepts(msg): self.handle(msg, handshake)
+
+    def accepts(self, msg, expect=None) -> bool:
+        '''Check if a datagram belongs to this connection and, if expect is given, is of 
+        that packet type'''
+        return self.codec.connection_id(msg) == self.cid and (not expect or self.codec.packet_type(msg) == expect)
+
+    def handle(self, msg, handshake=False) -> None:
+        '''Log data with current sequence and ack number. Process acks and SACK blocks'''
+        seq, ack, data, packet_type, options = self.decode(msg)
+        options = unpack_options(options)
         self.add_log(Action.RECEIVE, seq, ack, data, packet_type)
         self.__update_ack(seq, data, packet_type)
+        if packet_type == Packet.SYNACK: self.__negotiate(options, ack)
+        if Option.WINDOW in options and not handshake:
+            self.peer_edge = ack + UINT32.unpack(options[Option.WINDOW])[0]
         if not handshake: 
-            new_slots = self.window.ack(ack)
-            if new_slots == 0: self.stats["dup_ack"] += 1
+            self.__sack(options.get(Option.SACK))
+            acked = self.window.ack(ack)
+            if not acked: 
+                self.stats["dup_ack"] += 1
+                self.__dup_ack(ack)
+            else: 
+                self.__sample_rtt(acked)
+                self.__new_ack(ack, sum(len(slot[2]) for slot in acked))
+            full = self.trace.level == Trace.FULL
+            if full: self.cwnd_log.append((self.get_time(), self.cc.cwnd, self.cc.ssthresh))
+            if self.pacer: 
+                self.pacer.update(self.cc, self.recovery != Recovery.NONE, self.rto.srtt, self.get_time(), full)
+        if self.session: self.__files_acked(ack)
 
     def drop(self, data, packet_type) -> None:
         '''Log data with current sequence and ack number. Drops the packet'''
         self.add_log(Action.DROP, self.seq, self.ack, data, packet_type)
         self.__update_seq(data, packet_type)
-        self.window.add(self.seq, self.ack, data)
+        self.window.add(self.seq, self.ack, data, self.clock())
         self.stats["tot_data"] += len(data)
         if packet_type == Packet.DATA: self.stats["num_seg"] += 1
         self.stats["drp_pkt"] += 1
 
+    def set_window(self, MSS, MWS, features=FEATURES) -> None:
+        '''Offer MSS, maximum window and feature flags in the SYN. The receiver's SYNACK 
+        may lower them'''
+        self.mss, self.max_window, self.features = MSS, MWS, features
+        self.syn_options[Option.MSS] = UINT32.pack(MSS)
+        self.syn_options[Option.WINDOW] = UINT32.pack(MWS)
+        self.syn_options[Option.FEATURES] = UINT16.pack(features)
+        self.window = SenderWindow(max(MWS // MSS, 1))
+
+    def __negotiate(self, options, ack) -> None:
+        '''Adopt the MSS, window and features the receiver agreed to, the offset to resume
+        from and a new connection token. Data on the SYN that the SYNACK does not 
+        acknowledge was refused and is sent again as normal segments'''
+        if ack != self.seq: self.seq, self.early = ack, 0
+        if Option.TOKEN in options: self.token = options[Option.TOKEN]
+        if Option.RESUME in options: self.resume = UINT64.unpack(options[Option.RESUME])[0]
+        if Option.MSS not in options: return
+        mss, window = UINT32.unpack(options[Option.MSS])[0], UINT32.unpack(options[Option.WINDOW])[0]
+        self.features = UINT16.unpack(options[Option.FEATURES])[0]
+        if not self.features & Feature.FEC: self.fec = 0
+        if mss != self.mss: self.cc = type(self.cc)(mss)
+        self.mss, self.max_window = mss, window
+        self.window = SenderWindow(max(window // mss, 1))
+
+    def set_fec(self, group) -> None:
+        '''Send an XOR parity segment after every group of new data segments, so the 
+        receiver can rebuild one lost segment per group. Needs set_window first'''
+        self.fec = group
+        self.features |= Feature.FEC
+        self.syn_options[Option.FEATURES] = UINT16.pack(self.features)
+        self.syn_options[Option.FEC] = bytes([group])
+
+    def set_compression(self, level, adaptive=False, algorithm=Compression.ZLIB) -> None:
+        '''Offer to compress the file before segmentation. If the receiver agrees the 
+        stream is compressed at level, adapted to the CPU cost if adaptive. Needs 
+        set_window first'''
+        self.compression = (level, adaptive, algorithm)
+        self.features |= Feature.COMPRESS
+        self.syn_options[Option.FEATURES] = UINT16.pack(self.features)
+        self.syn_options[Option.COMPRESS] = bytes([algorithm])
+
+    def set_delta(self, block=0) -> None:
+        '''Offer to send the file as a delta against the receiver's copy, in blocks of 
+        block bytes or a size the receiver picks. Needs set_window first'''
+        self.features |= Feature.DELTA
+        self.syn_options[Option.FEATURES] = UINT16.pack(self.features)
+        self.syn_options[Option.DELTA] = UINT32.pack(block)
+
+    def __receive_reverse(self) -> bytearray:
+        '''Receive data the receiver sends back on a reverse connection it opens to this
+        socket: the block signatures of its copy, or the manifest of its tree'''
+        reverse = Receiver(self.client, self.seq, 0, self.codec)
+        reverse.set_trace(Trace.OFF)
+        sink = BufferSink()
+        reverse.transfer(sink)
+        return sink.buffer
+
+    def set_resumable(self, identity) -> None:
+        '''Announce the identity of the file in the SYN, so a receiver holding a 
+        checkpoint of it can answer with the offset to resume from'''
+        self.syn_options[Option.IDENTITY] = identity
+
+    def set_session(self, session) -> None:
+        '''Offer to send a SessionSource of many files, or a TreeSource, on this 
+        connection. The latency of each file is recorded as its last byte is acknowledged.
+        Needs set_window first'''
+        self.session = session
+        self.features |= Feature.SESSION
+        self.syn_options[Option.FEATURES] = UINT16.pack(self.features)
+        self.syn_options[Option.SESSION] = bytes([session.MODE])
+
+    def set_token(self, token) -> None:
+        '''Present a connection token from an earlier SYNACK, or b"" to ask for one. With
+        a token the first segment rides on the SYN, and is accepted if the token is valid'''
+        self.token = token
+        self.syn_options[Option.TOKEN] = token
+
+    def connect(self, file) -> None:
+        '''Send the SYN, carrying the first segment of the file if a token lets it. Data on
+        the SYN is not offered with resumption, delta or compression, which the receiver
+        must agree to before the stream can start, nor with FEC, whose groups start at
+        the first data segment'''
+        if not self.session: self.set_size(file.length)
+        data = Data.NONE
+        if self.token and not self.compression and not self.fec and Option.DELTA not in self.syn_options \
+                and Option.IDENTITY not in self.syn_options: 
+            data = file.segment(file.offset, min(self.mss, file.size - file.offset))
+        self.stream_start, self.opened, self.early = self.seq + 1, self.clock(), len(data)
+        self.send(data, Packet.SYN, handshake=True)
+
+    def source(self, file) -> FileSource:
+        '''Return the segment source for a file once the handshake is done: the file 
+        from the agreed resume offset or after the data the SYN carried, or its delta or
+        compressed stream if agreed. A tree is framed once the receiver's manifest is known'''
+        if self.remote is not None: file.plan(self.remote)
+        file.offset = min(file.offset + self.resume + self.early, file.size)
+        if self.signatures is not None: 
+            self.delta = DeltaSource(file, self.signatures)
+            return self.delta
+        if not self.compression or not self.features & Feature.COMPRESS: return file
+        self.compressed = CompressedSource(file, *self.compression)
+        return self.compressed
+
+    def set_offset(self, offset) -> None:
+        '''Announce in the SYN that the data belongs at offset in the receiver's file'''
+        self.syn_options[Option.OFFSET] = UINT64.pack(offset)
+
+    def set_size(self, size) -> None:
+        '''Announce in the SYN the size of the receiver's file, so it can be preallocated'''
+        self.syn_options[Option.SIZE] = UINT64.pack(size)
+
+    def transfer(self, file) -> None:
+        '''Open the connection, send the file source and tear down. No connection or 
+        teardown packets are dropped. For a delta the receiver first sends its block
+        signatures back, and for a tree the manifest of its copy. A session the receiver
+        refuses is closed without sending it'''
+        self.connect(file)
+        self.receive(handshake=True, expect=Packet.SYNACK)
+        self.send(Data.NONE, Packet.ACK, handshake=True)
+        if self.session and not self.features & Feature.SESSION: 
+            self.__close()
+            raise ConnectionRefusedError("receiver does not accept sessions")
+        if self.features & Feature.DELTA and Option.DELTA in self.syn_options: 
+            self.signatures = self.__receive_reverse()
+        if self.session and self.session.MODE == Session.TREE: self.remote = self.__receive_reverse()
+        file = self.source(file)
+        while file.offset < file.size or not self.is_empty():
+            self.poll_send(file)
+            self.poll_receive()
+        self.__close()
+
+    def __close(self) -> None:
+        '''Tear down the connection'''
+        self.send(Data.NONE, Packet.FIN, handshake=True)
+        self.receive(handshake=True, expect=Packet.FINACK)
+        self.send(Data.NONE, Packet.ACK, handshake=True)
+
+    def poll_send(self, file) -> None:
+        '''Send segments of the negotiated MSS from the file source until the window is full
+        or the pacer holds the next segment back'''
+        while not self.is_full() and file.offset < file.size and not self.time_to_send():
+            packet, seq = file.read(self.mss), self.seq
+            if self.pacer: self.pacer.consume(len(packet))
+            if self.PL_module(): self.send(packet, Packet.DATA)
+            else: self.drop(packet, Packet.DATA)
+            if self.fec: self.__add_parity(seq, packet, file.offset >= file.size)
+        self.flush()
+
+    def poll_receive(self) -> None:
+        '''Wait for an ack until the retransmission timer expires or the pacer releases 
+        the next segment'''
+        r, _, _ = select.select([self.client], [], [], self.time_to_wait())
+        if r: self.receive()
+        self.check_timeout()
+        self.flush()
+
+    def set_rto(self, initial, minimum, maximum) -> None:
+        '''Set initial timeout and clamps for the retransmission timer'''
+        self.rto = RTOEstimator(initial, minimum, maximum)
+
+    def set_congestion_control(self, cc) -> None:
+        '''Set the congestion controller limiting the window below MWS'''
+        self.cc = cc
+
+    def set_pacing(self, rate=0) -> None:
+        '''Pace new data segments at rate bytes per second, or from cwnd / SRTT if 0'''
+        self.pacer = Pacer(rate)
+
+    def time_to_send(self) -> float:
+        '''Return seconds until the pacer releases the next segment'''
+        return self.pacer.wait(self.mss, self.clock() / 1000) if self.pacer else 0
+
+    def time_to_wait(self) -> float:
+        '''Return seconds until the retransmission timer expires or, with room in the
+        window, the next paced segment is due'''
+        if self.is_full(): return self.time_to_expiry()
+        return min(self.time_to_expiry(), self.time_to_send() or float("inf"))
+
+    def time_to_expiry(self) -> float:
+        '''Return seconds until the retransmission timer expires. The timer runs from the 
+        later of the oldest packet's last transmission and the last ack of new data. With
+        nothing in flight it is the persist timer for zero window probes'''
+        if self.window.is_empty() and not self.__window_closed(): return self.rto.get_rto() / 1000
+        if self.window.is_empty(): start = self.timer_start
+        else: start = max(self.window.oldest()[3], self.timer_start)
+        return max(start + self.rto.get_rto() - self.clock(), 0) / 1000
+
+    def check_timeout(self) -> None:
+        '''Retransmit the oldest unacknowledged packet if the timer has expired and 
+        recover the remaining holes in order as acks arrive. With nothing in flight and the 
+        receiver's window closed, send a zero window probe instead'''
+        if self.time_to_expiry() > 0: return
+        if self.window.is_empty(): return self.__probe() if self.__window_closed() else None
+        self.rto.timeout()
+        self.cc.on_timeout(self.window.in_flight, self.clock() / 1000)
+        self.dup_acks, self.recovery, self.recover = 0, Recovery.TIMEOUT, self.seq
+        self.rexmit_next = self.window.oldest()[0]
+        self.stats["rto_exp"] += 1
+        self.resend(self.window.oldest(), Packet.DATA)
+
+    def __add_parity(self, seq, data, last) -> None:
+        '''XOR a new data segment into the current group's parity and send the parity once
+        the group is full or the data runs out. Parity segments are not retransmitted'''
+        parity = self.parity
+        if not parity[1]: parity[0], parity[2] = seq, 0
+        parity[1] += 1
+        parity[2] ^= int.from_bytes(data, "little")
+        if parity[1] < self.fec and not last: return
+        start, length, data = parity[0], seq + len(data) - parity[0], parity[2].to_bytes(self.mss, "little")
+        parity[1] = 0
+        self.stats["fec_sent"] += 1
+        if not self.PL_module(): return self.add_log(Action.DROP, start, self.ack, data, Packet.PARITY)
+        options = pack_options({ Option.GROUP: UINT32.pack(length) })
+        self.__transmit(self.encode(start, self.ack, data, Packet.PARITY, options))
+        self.add_log(Action.SEND, start, self.ack, data, Packet.PARITY)
+
+    def __window_closed(self) -> bool:
+        '''Check if the receiver's advertised window leaves no room for a full segment'''
+        return self.peer_edge is not None and self.seq + self.mss > self.peer_edge
+
+    def __probe(self) -> None:
+        '''Send an empty segment at the next sequence number. The receiver acknowledges it
+        with its current window. Probes back off like retransmissions'''
+        self.rto.timeout()
+        self.timer_start = self.clock()
+        self.stats["probes"] += 1
+        self.__transmit(self.encode(self.seq, self.ack, Data.NONE, Packet.DATA), handshake=True)
+        self.add_log(Action.SEND, self.seq, self.ack, Data.NONE, Packet.DATA)
+
+    def __dup_ack(self, ack) -> None:
+        '''Count duplicates of the ack for the oldest packet. The third one fast retransmits
+        that packet and starts NewReno fast recovery until everything sent so far is acked'''
+        oldest = self.window.oldest()
+        if not oldest or ack != oldest[0] - len(oldest[2]): return
+        self.dup_acks += 1
+        if self.recovery == Recovery.FAST: self.cc.on_dup_ack()
+        if self.recovery: return self.__resend_hole()
+        if self.dup_acks != DUP_ACK_THRESHOLD: return
+        self.recovery, self.recover, self.rexmit_next = Recovery.FAST, self.seq, oldest[0]
+        self.cc.on_loss(self.window.in_flight, self.clock() / 1000)
+        self.stats["fast_re"] += 1
+        self.resend(oldest, Packet.DATA)
+
+    def __new_ack(self, ack, acked) -> None:
+        '''Grow the window and leave recovery on a full ack. A partial ack means the next 
+        hole was also lost, so it is retransmitted immediately without waiting for more 
+        duplicates'''
+        self.dup_acks = 0
+        self.rto.reset_backoff()
+        self.timer_start = self.clock()
+        if self.recovery != Recovery.FAST: 
+            self.cc.on_ack(acked, self.clock() / 1000, (self.rto.srtt or 0) / 1000)
+        if not self.recovery: return
+        if ack >= self.recover or self.window.is_empty(): 
+            if self.recovery == Recovery.FAST: self.cc.on_recovery_exit()
+            self.recovery = Recovery.NONE
+            return
+        if self.recovery == Recovery.FAST: self.cc.on_partial_ack(acked)
+        if self.window.oldest()[0] > self.rexmit_next and self.__lost(self.window.oldest()):
+            self.rexmit_next = self.window.oldest()[0]
+            self.stats["fast_re"] += 1
+            self.resend(self.window.oldest(), Packet.DATA)
+        else: self.__resend_hole()
+
+    def __lost(self, slot) -> bool:
+        '''Check if a packet is presumed lost on a partial ack. With SACK only data above it 
+        reaching the receiver says so, since FEC or reordering can fill holes unasked'''
+        return not self.features & Feature.SACK or slot[0] < self.high_sack
+
+    def __sack(self, value) -> None:
+        '''Mark packets covered by the ack's SACK blocks on the window scoreboard'''
+        if not value: return
+        for start, end in unpack_sack(value):
+            self.stats["sacked"] += self.window.sack(start, end)
+            self.high_sack = max(self.high_sack, end)
+
+    def __resend_hole(self) -> None:
+        '''During recovery, retransmit the next packet below the highest SACKed sequence
+        number that was neither SACKed nor already retransmitted in this recovery'''
+        hole = self.window.next_hole(self.rexmit_next, self.high_sack)
+        if not hole: return
+        self.rexmit_next = hole[0]
+        self.stats["sack_re"] += 1
+        self.resend(hole, Packet.DATA)
+
+    def __files_acked(self, ack) -> None:
+        '''Record the latency of each session file whose last byte ack covers, from when
+        its first byte was read, or from the SYN for files that went out with it'''
+        session, done = self.session, len(self.latencies)
+        while done < len(session.ends) and session.ends[done] <= ack - self.stream_start:
+            start = session.started[done] if done and session.started[done] else self.opened
+            self.latencies.append((session.names[done], session.files[done].length, self.clock() - start))
+            done += 1
+
+    def __sample_rtt(self, acked) -> None:
+        '''Take an RTT sample from the newest acknowledged packet. By Karn's rule no sample
+        is taken if any acknowledged packet was retransmitted'''
+        if any(slot[4] for slot in acked): return
+        self.rto.sample(self.clock() - acked[-1][3])
+
     def set_PL_module(self, seed, pdrop) -> None:
-        '''Set drop rate and seed for PL module'''
-        random.seed(seed)
+        '''Set drop rate and seed for PL module. Each sender draws from its own generator, 
+        so transfers sharing a process keep their own drop sequences'''
+        self.random = random.Random(seed)
         self.pdrop = pdrop
 
     def PL_module(self) -> bool:
         '''Activate the PL module'''
-        return True if random.random() > self.pdrop else False
+        return True if self.random.random() > self.pdrop else False
 
     def __update_ack(self, seq, data, packet_type) -> None:
         '''Given a receiver's sequence number, update the sender's ack number '''
@@ -154,13 +2016,16 @@ class Sender(TCP):
         else: self.ack += len(data)
 
     def __update_seq(self, data, packet_type) -> None:
-        '''Update sequence number to the next expected sequence number'''
+        '''Update sequence number to the next expected sequence number. Data on a SYN 
+        follows the SYN's own byte'''
         if packet_type in self.header_bytes(): self.seq += 1
-        else: self.seq += len(data)
+        self.seq += len(data)
 
     def is_full(self) -> bool:
-        '''Check if current window is full'''
-        return self.window.is_full()
+        '''Check if current window is full. The effective window is min(cwnd, MWS), and no
+        segment is sent past the receiver's advertised window'''
+        return self.window.is_full() or self.window.in_flight + self.cc.mss > self.cc.cwnd \
+            or self.__window_closed()
 
     def is_empty(self) -> bool:
         '''Check if current window is empty'''
@@ -172,52 +2037,524 @@ class Sender(TCP):
 
 class Receiver(TCP):
 
-    def __init__(self, server, seq, ack) -> None:
+    def __init__(self, server, seq, ack, codec=None) -> None:
         '''Initialise Receiver instance'''
-        super().__init__(seq, ack)
+        super().__init__(seq, ack, codec)
         self.server = server
         self.addr = None
         self.window = None
-        self.stats = { "tot_data": 0, "num_seg": 0, "num_dup": 0 }
+        self.ack_every = 1
+        self.ack_delay = ACK_DELAY
+        self.ack_pending = 0
+        self.ack_deadline = None
+        self.in_order = False
+        self.gro = False
+        self.datagrams = list()
+        self.state = State.LISTEN
+        self.offset = 0
+        self.base = None
+        self.sink = None
+        self.max_mss = MAX_MSS
+        self.buffer_size = RECEIVE_BUFFER
+        self.mss = None
+        self.max_window = RECEIVE_BUFFER
+        self.features = FEATURES
+        self.synack_options = dict()
+        self.ack_needed = True
+        self.fec = 0
+        self.groups = dict()
+        self.decoder = None
+        self.checkpoint = None
+        self.identity = None
+        self.size = None
+        self.resumed = 0
+        self.saved = 0
+        self.basis = None
+        self.signature_bytes = 0
+        self.open_file = None
+        self.session = None
+        self.tree = None
+        self.manifest_bytes = 0
+        self.secret = None
+        self.token_valid = False
+        self.early = 0
+        self.stats = { "tot_data": 0, "num_seg": 0, "num_dup": 0, "num_ack": 0, "sys_rcv": 0, 
+            "num_ovf": 0, "num_par": 0, "num_fec": 0 }
+
+    def enable_gro(self) -> bool:
+        '''Read coalesced bursts with UDP GRO on Linux. Return whether the kernel 
+        accepted the option'''
+        self.gro = enable_udp_gro(self.server)
+        return self.gro
 
     def send(self, data, packet_type, handshake=False) -> None:
-        '''Encode data with current cumulative ack. Logs and sends the packet'''
+        '''Encode data with current cumulative ack, SACK blocks and free window. Logs and
+        sends the packet'''
         cum_ack = self.ack if handshake else self.window.get_cum_ack()
-        self.server.sendto(self.encode(self.seq, cum_ack, data, packet_type), self.addr)
+        options = self.synack_options if packet_type == Packet.SYNACK else dict()
+        if not handshake and self.features & Feature.SACK: 
+            blocks = self.window.sack_blocks(MAX_SACK_BLOCKS)
+            if blocks: options[Option.SACK] = pack_sack(blocks)
+        if not handshake and self.features & Feature.WINDOW: 
+            options[Option.WINDOW] = UINT32.pack(self.free_window())
+        options = pack_options(options) if options else b""
+        self.server.sendto(self.encode(self.seq, cum_ack, data, packet_type, options), self.addr)
         self.add_log(Action.SEND, self.seq, cum_ack, data, packet_type)
         if packet_type in self.header_bytes(): self.seq += 1
         else: self.seq += len(data)
+        if not handshake: 
+            self.ack_pending, self.ack_deadline = 0, None
+            self.stats["num_ack"] += 1
+
+    def set_delayed_ack(self, every, delay) -> None:
+        '''Acknowledge every Nth in order segment, or after delay milliseconds'''
+        self.ack_every = every
+        self.ack_delay = delay
+
+    def set_limits(self, max_mss, buffer_size) -> None:
+        '''Largest MSS and receive buffer, in bytes, to agree to in the handshake'''
+        self.max_mss = max_mss
+        self.buffer_size = buffer_size
+
+    def free_window(self) -> int:
+        '''Return the free receive buffer: the agreed window less the out of order data
+        held above the cumulative ack'''
+        return max(self.max_window - self.window.ranges.covered, 0)
+
+    def set_sink(self, sink) -> None:
+        '''Write every segment straight to the FileSink at its offset. The sink is 
+        preallocated to the size the sender announces and the window only tracks which
+        ranges have arrived'''
+        self.sink = sink
+
+    def set_delta(self, basis) -> None:
+        '''Agree to receive the file as a delta against basis, the FileSource of the copy
+        held here. The sink must be another file, as the basis is read while it is 
+        written'''
+        self.basis = basis
+
+    def set_session(self, open_file) -> None:
+        '''Agree to receive a session of many files. Each is written to the FileSink that
+        open_file(name) returns, and no sink is needed for the connection itself'''
+        self.open_file = open_file
+
+    def set_tree(self, tree) -> None:
+        '''Agree to receive a directory tree session into the TreeSink, after sending 
+        the sender the manifest of the tree held here'''
+        self.tree = tree
+        self.set_session(tree.open_file)
+
+    def set_zero_rtt(self, secret) -> None:
+        '''Hand out connection tokens keyed with secret in the SYNACK, and accept the 
+        data on a SYN that presents a valid one'''
+        self.secret = secret
+
+    def __send_reverse(self, data) -> None:
+        '''Send data back to the sender on a reverse connection'''
+        reverse = Sender(self.server, self.seq, 0, 1, self.addr, self.codec)
+        reverse.set_window(self.mss, self.max_window, self.features & (Feature.SACK | Feature.WINDOW))
+        reverse.set_congestion_control(Reno(self.mss))
+        reverse.set_trace(Trace.OFF)
+        with BufferSource(data) as source: reverse.transfer(source)
 
-    def receive(self, handshake=False) -> str:
-        '''Receive and parse segment. Return or buffer data'''
-        msg, self.addr = self.server.recvfrom(MAX_SEG_SIZE)
-        seq, ack, data, packet_type = self.decode(msg)
+    def set_checkpoint(self, path) -> None:
+        '''Keep a checkpoint of a resumable transfer at path: the file identity, its size 
+        and the contiguous bytes written. A sender reconnecting with the same identity is
+        told to resume after them. The checkpoint is removed once the transfer completes'''
+        self.checkpoint = path
+
+    def received(self) -> int:
+        '''Return the file offset up to which every byte has been written'''
+        if self.decoder: return self.offset + self.decoder.written
+        if not self.window: return self.offset
+        return self.offset + self.window.get_cum_ack() - self.base
+
+    def save_checkpoint(self) -> None:
+        '''Flush the file and save the checkpoint of a resumable transfer'''
+        if not self.checkpoint or self.identity is None: return
+        if self.sink: self.sink.sync()
+        write_checkpoint(self.checkpoint, { "identity": self.identity.hex(), "size": self.size,
+            "offset": self.received() })
+        self.saved = self.clock()
+
+    def acknowledge(self) -> None:
+        '''Acknowledge the last segment received. Out of order arrivals, duplicates and
+        hole fills are acknowledged at once, other acks are delayed. Parity segments that
+        rebuild nothing are not acknowledged'''
+        if not self.ack_needed: return
+        self.ack_pending += 1
+        if not self.in_order or self.ack_pending >= self.ack_every: 
+            return self.send(Data.NONE, Packet.ACK)
+        if self.ack_deadline is None: self.ack_deadline = self.clock() + self.ack_delay
+
+    def transfer(self, sink) -> None:
+        '''Accept a connection and write its data to the FileSink, starting at the offset
+        the sender announced, until teardown. For a delta the block signatures of the 
+        basis are sent back first, and for a tree the manifest of the tree held here. A
+        SYN during the transfer replaces the connection with the new one'''
+        self.set_sink(sink)
+        self.receive(handshake=True)
+        self.__accept()
+        while True:
+            data = self.receive()
+            if data == Data.RESET: self.__accept()
+            elif not data: break
+            else: self.acknowledge()
+        self.send(Data.NONE, Packet.FINACK, handshake=True)
+        self.receive(handshake=True)
+
+    def __accept(self) -> None:
+        '''Answer the SYN and complete the handshake, then send back what the sender 
+        needs before the data: the block signatures of a delta basis or the manifest of
+        a tree'''
+        self.send(Data.NONE, Packet.SYNACK, handshake=True)
+        self.receive(handshake=True)
+        if self.features & Feature.DELTA: 
+            signatures = block_signatures(self.basis, self.decoder.block)
+            self.signature_bytes = len(signatures)
+            self.__send_reverse(signatures)
+        if self.features & Feature.SESSION and self.session == Session.TREE:
+            manifest = self.tree.local_manifest()
+            self.manifest_bytes = len(manifest)
+            self.__send_reverse(manifest)
+
+    def receive(self, handshake=False) -> bytes:
+        '''Receive and parse segment. Return the data it makes contiguous or Data.BUFFERED.
+        A delayed ack is sent if its timer expires while waiting'''
+        while self.ack_deadline is not None and not self.datagrams and not select.select(
+                [self.server], [], [], self.ack_wait())[0]:
+            self.send(Data.NONE, Packet.ACK)
+        return self.handle(self.__recvfrom(), handshake)
+
+    def step(self, msg) -> bytes:
+        '''Advance the connection state machine with a datagram, replying as needed. 
+        Return in order data to write or Data.NONE. Until a SYN arrives anything else is
+        ignored'''
+        if self.state == State.LISTEN:
+            if self.codec.packet_type(msg) != Packet.SYN: return Data.NONE
+            self.handle(msg, handshake=True)
+            self.send(Data.NONE, Packet.SYNACK, handshake=True)
+            self.state = State.SYN_RECEIVED
+        elif self.state == State.SYN_RECEIVED:
+            self.handle(msg, handshake=True)
+            self.state = State.ESTABLISHED
+        elif self.state == State.ESTABLISHED:
+            data = self.handle(msg)
+            if data == Data.RESET:
+                self.send(Data.NONE, Packet.SYNACK, handshake=True)
+                self.state = State.SYN_RECEIVED
+                return Data.NONE
+            if not data:
+                self.send(Data.NONE, Packet.FINACK, handshake=True)
+                self.state = State.LAST_ACK
+                return Data.NONE
+            self.acknowledge()
+            return data if data != Data.BUFFERED else Data.NONE
+        elif self.state == State.LAST_ACK:
+            self.handle(msg, handshake=True)
+            self.state = State.CLOSED
+        return Data.NONE
+
+    def ack_wait(self) -> float:
+        '''Return seconds until the delayed ack is due, or None if no ack is pending'''
+        if self.ack_deadline is None: return None
+        return max(self.ack_deadline - self.clock(), 0) / 1000
+
+    def handle(self, msg, handshake=False) -> bytes:
+        '''Parse segment. Return the data it makes contiguous or Data.BUFFERED. A SYN 
+        after the handshake, from a sender that restarted, resets the connection to the 
+        new one and returns Data.RESET, to be answered with a SYNACK. Duplicate SYNs and 
+        segments left over from an earlier connection are dropped unacknowledged'''
+        seq, ack, data, packet_type, options = self.decode(msg)
+        cid = self.codec.connection_id(msg)
+        if not handshake and packet_type == Packet.SYN and cid != self.cid:
+            self.__reset()
+            self.handle(msg, handshake=True)
+            return Data.RESET
+        if not handshake and (packet_type == Packet.SYN or cid != self.cid):
+            self.ack_needed = False
+            return Data.BUFFERED
+        if packet_type == Packet.SYN: self.cid = cid
+        if packet_type == Packet.SYN: self.__handle_syn(unpack_options(options))
+        self.ack_needed = packet_type != Packet.PARITY
         if handshake: self.add_log(Action.RECEIVE, seq, ack, data, packet_type)
+        elif packet_type == Packet.PARITY: data = self.__handle_parity(seq, ack, data, unpack_options(options))
         else: data = self.__handle_window(seq, ack, data, packet_type)
         if not self.ack: self.ack = seq
         if packet_type in self.header_bytes(): self.ack += 1
-        if data != Data.BUFFERED and packet_type == Packet.DATA: 
-            self.stats["tot_data"] += len(data)
-            self.stats["num_seg"] += 1
+        if packet_type == Packet.SYN and data and self.__early(data): 
+            return self.__handle_window(self.ack, ack, data, Packet.DATA)
         return data
 
-    def __handle_window(self, seq, ack, data, packet_type):
-        '''Add data to buffer if necessary and update cumulative ack'''
-        if not self.window: self.window = ReceiverWindow(seq)
-        buf_data, ln = self.window.get_buf_data(seq), len(data)
-        if self.ack != seq:
-            self.window.add_to_buf(seq, data)
+    def __reset(self) -> None:
+        '''Save the checkpoint and forget the state of the current connection'''
+        self.save_checkpoint()
+        self.window, self.base, self.offset, self.ack = None, None, 0, 0
+        self.ack_pending, self.ack_deadline, self.in_order = 0, None, False
+        self.mss, self.max_window, self.features, self.synack_options = None, RECEIVE_BUFFER, FEATURES, dict()
+        self.fec, self.groups, self.decoder, self.session = 0, dict(), None, None
+        self.identity, self.size, self.resumed = None, None, 0
+        self.token_valid, self.early = False, 0
+
+    def __handle_syn(self, options) -> None:
+        '''Apply the options announced in the sender's SYN and agree to the smaller of each
+        offered limit and our own. A segment is no larger than the offered window, so the
+        window is at least one segment and never more than the sender offered'''
+        if Option.MSS in options:
+            offer = UINT32.unpack(options[Option.WINDOW])[0]
+            self.mss = min(UINT32.unpack(options[Option.MSS])[0], self.max_mss, offer)
+            self.max_window = max(min(offer, self.buffer_size), self.mss)
+            self.features = UINT16.unpack(options[Option.FEATURES])[0] & FEATURES
+            if self.features & Feature.FEC and Option.FEC in options: self.fec = options[Option.FEC][0]
+            algorithm = options.get(Option.COMPRESS, b"\0")[0]
+            if self.features & Feature.COMPRESS and algorithm in COMPRESSORS: 
+                self.decoder = StreamDecoder(algorithm)
+            else: self.features &= ~Feature.COMPRESS
+            if self.features & Feature.DELTA and Option.DELTA in options and self.basis:
+                block = UINT32.unpack(options[Option.DELTA])[0] or delta_block(self.basis.length)
+                self.decoder = DeltaDecoder(self.basis, block)
+                self.features &= ~Feature.COMPRESS
+            else: self.features &= ~Feature.DELTA
+            self.session = options.get(Option.SESSION, b"\xff")[0]
+            if self.features & Feature.SESSION and self.open_file and (self.session == Session.FILES 
+                    or self.session == Session.TREE and self.tree):
+                self.decoder = SessionDecoder(self.open_file)
+                self.features &= ~(Feature.COMPRESS | Feature.DELTA)
+            else: self.features &= ~Feature.SESSION
+            self.synack_options = { Option.MSS: UINT32.pack(self.mss), 
+                Option.WINDOW: UINT32.pack(self.max_window), Option.FEATURES: UINT16.pack(self.features) }
+        if Option.OFFSET in options: self.offset = UINT64.unpack(options[Option.OFFSET])[0]
+        if Option.SIZE in options: self.size = UINT64.unpack(options[Option.SIZE])[0]
+        if Option.IDENTITY in options and self.checkpoint: self.__resume(options[Option.IDENTITY])
+        if Option.SIZE in options and self.sink: self.sink.allocate(self.size)
+        if Option.TOKEN in options and self.secret: self.__check_token(options[Option.TOKEN])
+
+    def __check_token(self, token) -> None:
+        '''Check the token the sender presented and hand it the current one, a keyed 
+        digest of its address'''
+        current = hashlib.blake2b(self.addr[0].encode(), key=self.secret, digest_size=8).digest()
+        self.token_valid = hmac.compare_digest(token, current)
+        self.synack_options[Option.TOKEN] = current
+
+    def __early(self, data) -> bool:
+        '''Check if the data on a SYN may be accepted: the token was valid, it fits the 
+        agreed MSS, and no resume offset, stream encoding or FEC applies'''
+        if not self.token_valid or len(data) > (self.mss or 0) or self.resumed or self.fec: return False
+        if self.features & (Feature.COMPRESS | Feature.DELTA): return False
+        self.early = len(data)
+        return True
+
+    def __resume(self, identity) -> None:
+        '''Resume after the bytes a checkpoint of the same file version holds, and tell 
+        the sender in the SYNACK. The output file must still be there at the size the
+        checkpoint was taken at'''
+        self.identity = identity
+        state = read_checkpoint(self.checkpoint)
+        if not state or state.get("identity") != identity.hex() or state.get("size") != self.size: return
+        if not self.sink or self.sink.length() != self.size: return
+        self.resumed = min(max(state["offset"] - self.offset, 0), (self.size or 0) - self.offset)
+        self.offset += self.resumed
+        self.synack_options[Option.RESUME] = UINT64.pack(self.resumed)
+
+    def __recvfrom(self) -> bytes:
+        '''Return the next datagram. With GRO a coalesced burst is split by its segment 
+        size and the remaining datagrams are queued'''
+        if self.datagrams: return self.datagrams.pop()
+        self.stats["sys_rcv"] += 1
+        datagrams, self.addr = recv_datagrams(self.server, self.gro)
+        self.datagrams = datagrams[:0:-1]
+        return datagrams[0]
+
+    def __handle_window(self, seq, ack, data, packet_type, action=Action.RECEIVE) -> bytes:
+        '''Pass segment through the reassembly buffer, or write it to the sink, and update 
+        cumulative ack'''
+        self.__open_window()
+        if packet_type == Packet.FIN: 
             self.add_log(Action.RECEIVE, seq, ack, data, packet_type)
-            return Data.BUFFERED
-        elif buf_data:
-            self.add_log(Action.DROP, seq, ack, data, packet_type)
-            self.stats["num_dup"] += 1
-            if self.window.update_cum_ack(seq, ln): self.ack += ln
-            return buf_data
-        self.add_log(Action.RECEIVE, seq, ack, data, packet_type)
-        if packet_type == Packet.FIN: return data
-        if self.window.update_cum_ack(seq, ln): self.ack += ln
-        return data
+            if self.checkpoint and os.path.exists(self.checkpoint): os.remove(self.checkpoint)
+            return data
+        cum_ack = self.window.get_cum_ack()
+        if seq + len(data) > cum_ack + self.max_window: return self.__overflow(seq, ack, data, packet_type)
+        run, duplicate = self.window.add(seq, data)
+        if self.decoder: self.__decode(run)
+        elif self.sink and not duplicate: self.sink.write(self.offset + seq - self.base, data)
+        if self.fec and not duplicate: self.__add_group_segment(seq, data)
+        self.in_order = self.window.get_cum_ack() - cum_ack == len(data) and not self.window.ranges
+        self.add_log(Action.DROP if duplicate else action, seq, ack, data, packet_type)
+        if duplicate: self.stats["num_dup"] += 1
+        else:
+            self.stats["tot_data"] += len(data)
+            self.stats["num_seg"] += 1
+        self.ack = self.window.get_cum_ack()
+        if self.checkpoint and self.clock() - self.saved >= CHECKPOINT_INTERVAL: self.save_checkpoint()
+        return run if run else Data.BUFFERED
+
+    def __open_window(self) -> None:
+        '''Create the window at the first segment after the handshake. A compressed 
+        stream is reassembled in the window to be decoded in order'''
+        if self.window: return
+        self.window, self.base = ReceiverWindow(self.ack, not self.sink or self.decoder is not None), self.ack
+
+    def __decode(self, run) -> None:
+        '''Decompress an in order run of the compressed stream to the sink'''
+        if not run: return
+        start = self.decoder.written
+        data = self.decoder.decode(run)
+        if self.sink and data: self.sink.write(self.offset + start, data)
+
+    def __group(self, index) -> list:
+        '''Return the FEC group holding the segment with index, created empty: XOR of the 
+        data received and the indexes received'''
+        group = index // self.fec
+        if group not in self.groups: self.groups[group] = [0, set()]
+        return self.groups[group]
+
+    def __add_group_segment(self, seq, data) -> None:
+        '''XOR a new data segment into its FEC group. Groups below the cumulative ack are
+        complete and dropped'''
+        index, offset = divmod(seq - self.base, self.mss)
+        if offset: return
+        group = self.__group(index)
+        if index in group[1]: return
+        group[0] ^= int.from_bytes(data, "little")
+        group[1].add(index)
+        done = (self.window.get_cum_ack() - self.base) // (self.mss * self.fec)
+        for i in [i for i in self.groups if i < done]: del self.groups[i]
+
+    def __handle_parity(self, seq, ack, data, options) -> bytes:
+        '''Rebuild the one missing segment of a group from its parity and the rest of the
+        group, and pass it through the window as if it had arrived. Parity that does not
+        start on a group boundary of the receiver is ignored'''
+        self.__open_window()
+        self.add_log(Action.RECEIVE, seq, ack, data, Packet.PARITY)
+        self.stats["num_par"] += 1
+        if not self.fec or Option.GROUP not in options: return Data.BUFFERED
+        if (seq - self.base) % (self.mss * self.fec): return Data.BUFFERED
+        first = (seq - self.base) // self.mss
+        length = UINT32.unpack(options[Option.GROUP])[0]
+        count = -(-length // self.mss)
+        if seq + length <= self.window.get_cum_ack(): return Data.BUFFERED
+        group = self.__group(first)
+        missing = [i for i in range(first, first + count) if i not in group[1]]
+        if len(missing) != 1: return Data.BUFFERED
+        index = missing[0]
+        size = min(self.mss, seq + length - (self.base + index * self.mss))
+        rebuilt = (group[0] ^ int.from_bytes(data, "little")).to_bytes(self.mss, "little")[:size]
+        self.ack_needed = True
+        self.stats["num_fec"] += 1
+        return self.__handle_window(self.base + index * self.mss, ack, rebuilt, Packet.DATA, Action.RECOVER)
+
+    def __overflow(self, seq, ack, data, packet_type) -> str:
+        '''Drop a segment beyond the window. It is acknowledged at once with the window'''
+        self.in_order = False
+        self.add_log(Action.DROP, seq, ack, data, packet_type)
+        self.stats["num_ovf"] += 1
+        return Data.BUFFERED
+
+##################################################################
+# Receiver Server Class
+##################################################################
+
+class ReceiverServer:
+
+    def __init__(self, server, seq, open_file, codec=None) -> None:
+        '''Initialise a receiver serving many senders on one socket. Connections are keyed
+        by (peer address, connection id), each with its own Receiver. open_file(n, addr, cid)
+        returns the FileSink of the nth connection. Data is written at the offset the 
+        sender announced, so several connections may share one file. A connection silent 
+        for the idle timeout is closed as if it had finished'''
+        self.server = server
+        self.seq = seq
+        self.open_file = open_file
+        self.codec = codec if codec else BinaryCodec()
+        self.connections = dict()
+        self.files = dict()
+        self.heard = dict()
+        self.idle = IDLE_TIMEOUT
+        self.gro = False
+        self.datagrams = list()
+        self.count = 0
+        self.ack_every = 1
+        self.ack_delay = ACK_DELAY
+        self.trace = Trace.FULL
+        self.limits = (MAX_MSS, RECEIVE_BUFFER)
+        self.secret = None
+
+    def set_delayed_ack(self, every, delay) -> None:
+        '''Delayed ack settings for new connections'''
+        self.ack_every = every
+        self.ack_delay = delay
+
+    def set_limits(self, max_mss, buffer_size) -> None:
+        '''Largest MSS and receive buffer for new connections'''
+        self.limits = (max_mss, buffer_size)
+
+    def set_trace(self, level) -> None:
+        '''Trace level for new connections'''
+        self.trace = level
+
+    def set_zero_rtt(self, secret) -> None:
+        '''Connection token secret for new connections'''
+        self.secret = secret
+
+    def enable_gro(self) -> bool:
+        '''Read coalesced bursts with UDP GRO on Linux, split into datagrams before they
+        are dispatched. Return whether the kernel accepted the option'''
+        self.gro = enable_udp_gro(self.server)
+        return self.gro
+
+    def set_idle_timeout(self, seconds) -> None:
+        '''Seconds without a datagram after which a connection is closed'''
+        self.idle = seconds
+
+    def poll(self) -> list:
+        '''Wait for a datagram, the next delayed ack or idle timeout and dispatch it to its 
+        connection. Return the receivers whose connections closed or timed out'''
+        waits = [i.ack_wait() for i in self.connections.values() if i.ack_wait() is not None]
+        if self.heard: waits.append(max(min(self.heard.values()) + self.idle - time.monotonic(), 0))
+        r = self.datagrams or select.select([self.server], [], [], min(waits, default=None))[0]
+        for receiver in self.connections.values():
+            if receiver.ack_wait() == 0: receiver.send(Data.NONE, Packet.ACK)
+        now = time.monotonic()
+        closed = [self.__close(key) for key, heard in list(self.heard.items()) if now - heard >= self.idle]
+        if not r: return closed
+        msg, addr = self.__recvfrom()
+        key = (addr, self.codec.connection_id(msg))
+        if key not in self.connections:
+            if self.codec.packet_type(msg) != Packet.SYN: return closed
+            self.__accept(key)
+        receiver = self.connections[key]
+        self.heard[key] = now
+        receiver.step(msg)
+        if receiver.state != State.CLOSED: return closed
+        return closed + [self.__close(key)]
+
+    def __recvfrom(self) -> tuple:
+        '''Return the next datagram and its peer address, queueing the rest of a burst'''
+        if self.datagrams: return self.datagrams.pop()
+        datagrams, addr = recv_datagrams(self.server, self.gro)
+        self.datagrams = [(i, addr) for i in datagrams[:0:-1]]
+        return datagrams[0], addr
+
+    def __close(self, key) -> Receiver:
+        '''Close the output file of a connection and forget it'''
+        del self.heard[key]
+        self.files.pop(key).close()
+        return self.connections.pop(key)
+
+    def __accept(self, key) -> None:
+        '''Create the receiver and output file for a new connection'''
+        addr, cid = key
+        self.count += 1
+        receiver = Receiver(self.server, self.seq, 0, self.codec)
+        receiver.addr, receiver.cid, receiver.number = addr, cid, self.count
+        receiver.set_delayed_ack(self.ack_every, self.ack_delay)
+        receiver.set_trace(self.trace)
+        receiver.set_limits(*self.limits)
+        if self.secret: receiver.set_zero_rtt(self.secret)
+        self.connections[key] = receiver
+        self.files[key] = self.open_file(self.count, addr, cid)
+        receiver.set_sink(self.files[key])
 
 ##################################################################
 # Sender Window Class
@@ -226,47 +2563,88 @@ class Receiver(TCP):
 class SenderWindow(Slot):
 
     def __init__(self, window_length) -> None:
-        '''Initialise Sender Window instance'''
+        '''Initialise Sender Window instance. Slots form a ring buffer starting at head, 
+        each holding [seq, ack, packet, send time, retransmissions, SACKed] where seq is 
+        the sequence number after the packet. The ranges SACK blocks already covered are 
+        kept so each block only walks what is new'''
         self.size = window_length
-        self.window = collections.deque([Slot.EMPTY] * window_length)
+        self.window = [Slot.EMPTY] * window_length
+        self.head = 0
+        self.count = 0
+        self.in_flight = 0
+        self.sacked = IntervalSet()
 
-    def add(self, seq, ack, packet) -> None:
-        '''Add packet information to empty slot in window'''
-        for i, j in enumerate(self.window):
-            if j == Slot.EMPTY: 
-                self.window[i] = (seq, ack, packet)
-                return
+    def add(self, seq, ack, packet, sent) -> None:
+        '''Add packet information to the slot after the newest packet'''
+        self.window[(self.head + self.count) % self.size] = [seq, ack, packet, sent, 0, False]
+        self.count += 1
+        self.in_flight += len(packet)
+
+    def ack(self, ack) -> list:
+        '''Cumulatively acknowledge every packet ending at or before ack. 
+        Return the acknowledged slots, oldest first'''
+        acked = list()
+        while self.count and self.window[self.head][0] <= ack:
+            acked.append(self.window[self.head])
+            self.in_flight -= len(self.window[self.head][2])
+            self.window[self.head] = Slot.EMPTY
+            self.head = (self.head + 1) % self.size
+            self.count -= 1
+        self.sacked.discard_below(ack)
+        return acked
+
+    def retransmitted(self, slot, sent) -> None:
+        '''Record a retransmission of the slot's packet'''
+        slot[3] = sent
+        slot[4] += 1
+
+    def oldest(self) -> list:
+        '''Return the oldest unacknowledged slot'''
+        return self.window[self.head] if self.count else None
+
+    def sack(self, start, end) -> int:
+        '''Mark every packet lying wholly inside [start, end) as selectively acknowledged. 
+        Only packets overlapping the parts not covered by earlier blocks are visited. 
+        Return the number of newly marked packets'''
+        marked = 0
+        for low, high in self.sacked.gaps(start, end):
+            for i in range(self.__offset(low) or 0, self.count):
+                slot = self.window[(self.head + i) % self.size]
+                if slot[0] - len(slot[2]) >= high or slot[0] > end: break
+                if not slot[5] and slot[0] - len(slot[2]) >= start: 
+                    slot[5] = True
+                    marked += 1
+        self.sacked.add(start, end)
+        return marked
+
+    def next_hole(self, seq, limit) -> list:
+        '''Return the first packet starting at or after seq and ending at or before limit
+        that has not been selectively acknowledged'''
+        offset = self.__offset(seq, ceil=True)
+        if offset is None: return None
+        for i in range(max(offset, 0), self.count):
+            slot = self.window[(self.head + i) % self.size]
+            if slot[0] > limit: return None
+            if not slot[5]: return slot
+        return None
 
-    def ack(self, ack) -> int:
-        '''Acknowledge packet and update window. Return number of new slots created'''
-        for i, j in enumerate(self.window):
-            if j in (Slot.EMPTY, Slot.ACKED): continue
-            if j[0] == ack: 
-                self.window[i] = Slot.ACKED
-                return self.__move_window()
-        return 0
-
-    def __move_window(self) -> int:
-        '''Slide/update window. Uses collections.deque for O(1) popleft() operation'''
-        count = 0
-        while self.window[0] == Slot.ACKED:
-            self.window.popleft()
-            self.window.append(Slot.EMPTY)
-            count += 1
-        return count
-
-    def data_to_resend(self) -> list:
-        '''Return a list of packets in window that have not been acknowledged'''
-        return [(lambda a, b, c: (a - len(c), b, c))(*i) 
-            for i in self.window if i not in (Slot.EMPTY, Slot.ACKED)]
+    def __offset(self, seq, ceil=False) -> int:
+        '''Return the offset from the head of the packet starting at seq. Every packet 
+        but the newest is a full segment, so the offset is seq / segment size'''
+        if not self.count: return None
+        end, _, packet, _, _, _ = self.window[self.head]
+        size = max(len(packet), 1)
+        if ceil: return -(-(seq - end + len(packet)) // size)
+        if seq < end - len(packet): return None
+        return (seq - end + len(packet)) // size
 
     def is_full(self) -> bool:
         '''Check if current window is full'''
-        return all([False if i == Slot.EMPTY else True for i in self.window])
+        return self.count == self.size
 
     def is_empty(self) -> bool:
         '''Check if current window is empty'''
-        return all([True if i == Slot.EMPTY else False for i in self.window])
+        return self.count == 0
 
 ##################################################################
 # Receiver Window Class
@@ -274,33 +2652,68 @@ class SenderWindow(Slot):
 
 class ReceiverWindow:
 
-    def __init__(self, seq) -> None:
-        '''Initialise Receiver Window instance'''
+    def __init__(self, seq, store=True) -> None:
+        '''Initialise Receiver Window instance. Out of order segments are kept by 
+        sequence number with a min-heap of their sequence numbers for in-order draining,
+        and the ranges they cover for SACK blocks. Without store, segments are written 
+        elsewhere and only their ranges are kept'''
         self.seq = seq
-        self.buffer = set()
-
-    def update_cum_ack(self, ack, length) -> bool:
-        '''Update current cumulative ack'''
-        outcome = self.seq == ack
-        self.seq = self.seq + length if outcome else self.seq
-        return outcome
+        self.store = store
+        self.buffer = dict()
+        self.heap = list()
+        self.ranges = IntervalSet()
+        self.latest = None
 
     def get_cum_ack(self) -> int:
         '''Get current cumulative ack'''
         return self.seq
 
-    def add_to_buf(self, seq, data) -> None:
-        '''Add sequence number and data to buffer'''
-        self.buffer.add((seq, data))
-
-    def get_buf_data(self, seq) -> str:
-        '''Given a sequence number as key, return the buffered data'''
-        rtr = [(i, j) for i, j in self.buffer if i == seq]
-        if len(rtr) > 1: raise Exception        # REMOVE THIS LATER
-        return self.__rm_data(rtr)
-
-    def __rm_data(self, rtr) -> str:
-        '''Remove data from buffer and return the deleted data'''
-        if not rtr: return None
-        self.buffer.remove(rtr[0])
-        return rtr[0][1]
+    def add(self, seq, data) -> tuple:
+        '''Add segment to the window. Return the contiguous run of data now deliverable
+        (empty if none) and whether the segment was a duplicate'''
+        if seq + len(data) <= self.seq: return Data.NONE, True
+        if seq < self.seq: data, seq = data[self.seq - seq:], self.seq
+        if not self.store: return Data.NONE, self.__mark(seq, len(data))
+        if seq > self.seq: return Data.NONE, self.__buffer(seq, data)
+        self.seq += len(data)
+        return self.__drain([data]), False
+
+    def __buffer(self, seq, data) -> bool:
+        '''Buffer out of order segment. Return whether it was already buffered'''
+        self.latest = seq
+        if seq not in self.buffer: heapq.heappush(self.heap, seq)
+        elif len(self.buffer[seq]) >= len(data): return True
+        self.buffer[seq] = data
+        self.ranges.add(seq, seq + len(data))
+        return False
+
+    def __mark(self, seq, length) -> bool:
+        '''Record the range of a segment and advance the cumulative ack over received
+        ranges. Return whether it was already received'''
+        covered = self.ranges.find(seq)
+        if covered and covered[1] >= seq + length: return True
+        if seq > self.seq: self.latest = seq
+        self.ranges.add(seq, seq + length)
+        run = self.ranges.find(self.seq)
+        if run: self.seq = run[1]
+        self.ranges.discard_below(self.seq)
+        return False
+
+    def sack_blocks(self, limit) -> list:
+        '''Return up to limit buffered ranges, the one holding the latest segment first'''
+        if not self.ranges: return list()
+        latest = self.ranges.find(self.latest) if self.latest is not None else None
+        blocks = [latest] if latest else list()
+        return blocks + [i for i in self.ranges if i != latest][:limit - len(blocks)]
+
+    def __drain(self, run) -> bytes:
+        '''Append every buffered segment contiguous with the cumulative ack to the run, 
+        trimming any overlap with data already delivered'''
+        while self.heap and self.heap[0] <= self.seq:
+            seq = heapq.heappop(self.heap)
+            data = self.buffer.pop(seq)
+            if seq + len(data) <= self.seq: continue
+            run.append(data[self.seq - seq:])
+            self.seq = seq + len(data)
+        self.ranges.discard_below(self.seq)
+        return b"".join(run)
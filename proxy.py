@@ -0,0 +1,179 @@
+##################################################################
+# Network Impairment Proxy
+#
+# UDP relay between sender.py and receiver.py. Senders connect to
+# the listen port and each is relayed to the receiver from its own
+# upstream socket. Every datagram passes through the link model of
+# its direction (forward: sender to receiver, reverse: receiver to
+# sender), applied in this order:
+#
+#   - Bernoulli loss and Gilbert-Elliott burst loss
+#   - token-bucket bandwidth cap with a drop-tail queue
+#   - fixed delay plus uniform jitter, with extra delay for
+#     reordered segments
+#   - duplication
+#
+# Each direction draws from its own RNG seeded from --seed, so runs
+# are reproducible. As with the sender's drop module, connection and
+# teardown packets are never lost, duplicated or reordered: the
+# handshake does not retransmit, so each connection is only impaired
+# from its first data segment until its FIN. Statistics are printed
+# on exit.
+#
+# USAGE: python proxy.py listen_port receiver_host receiver_port [--seed S] [--idle s]
+#            [--codec binary|json]
+#            [--{fwd,rev}-loss p] [--{fwd,rev}-burst-p p] [--{fwd,rev}-burst-r p]
+#            [--{fwd,rev}-burst-loss p] [--{fwd,rev}-delay ms] [--{fwd,rev}-jitter ms]
+#            [--{fwd,rev}-reorder p] [--{fwd,rev}-reorder-delay ms]
+#            [--{fwd,rev}-duplicate p] [--{fwd,rev}-rate kbit/s]
+#            [--{fwd,rev}-bucket bytes] [--{fwd,rev}-queue bytes]
+##################################################################
+
+##################################################################
+# Imports
+##################################################################
+
+import sys
+import time
+import heapq
+import random
+import select
+import socket
+from helper import parse_options, CODECS, Packet, MAX_SEG_SIZE
+
+##################################################################
+# Constants
+##################################################################
+
+IP = '127.0.0.1'
+PROXY_ERROR = \
+    'USAGE: python proxy.py listen_port receiver_host receiver_port [--seed S] [--idle s] ' \
+    + '[--codec binary|json] ' \
+    + '[--{fwd,rev}-loss p] [--{fwd,rev}-burst-p p] [--{fwd,rev}-burst-r p] ' \
+    + '[--{fwd,rev}-burst-loss p] [--{fwd,rev}-delay ms] [--{fwd,rev}-jitter ms] ' \
+    + '[--{fwd,rev}-reorder p] [--{fwd,rev}-reorder-delay ms] [--{fwd,rev}-duplicate p] ' \
+    + '[--{fwd,rev}-rate kbit/s] [--{fwd,rev}-bucket bytes] [--{fwd,rev}-queue bytes]'
+
+# Per-direction link settings. Probabilities are per datagram, a rate of 0 is unlimited
+LINK = { "loss": 0.0, "burst_p": 0.0, "burst_r": 1.0, "burst_loss": 1.0, "delay": 0.0,
+    "jitter": 0.0, "reorder": 0.0, "reorder_delay": 10.0, "duplicate": 0.0, "rate": 0.0,
+    "bucket": 15000, "queue": 100000 }
+
+##################################################################
+# Link Class
+##################################################################
+
+class Link:
+
+    def __init__(self, name, settings, seed) -> None:
+        '''Initialise one direction of the path with its own seeded RNG'''
+        self.name = name
+        self.settings = settings
+        self.random = random.Random(f"{seed}.{name}")
+        self.bad = False
+        self.tokens = settings["bucket"]
+        self.stamp = None
+        self.stats = { "packets": 0, "lost": 0, "queue_drop": 0, "reordered": 0, "duplicated": 0,
+            "delivered": 0 }
+
+    def departures(self, now, size, spare=False) -> list:
+        '''Return the times, in seconds, at which copies of a datagram of size bytes arriving
+        at now leave the link. An empty list means it was dropped. Spared datagrams are 
+        delayed by the fixed delay only, never lost, duplicated or reordered'''
+        self.stats["packets"] += 1
+        if not spare and self.__lost():
+            self.stats["lost"] += 1
+            return list()
+        start = self.__shape(now, size)
+        if start is None:
+            self.stats["queue_drop"] += 1
+            return list()
+        copies = 2 if not spare and self.random.random() < self.settings["duplicate"] else 1
+        if copies == 2: self.stats["duplicated"] += 1
+        self.stats["delivered"] += copies
+        return [start + self.__delay(spare) for _ in range(copies)]
+
+    def __lost(self) -> bool:
+        '''Advance the Gilbert-Elliott state and draw the loss of one datagram'''
+        settings = self.settings
+        if self.bad and self.random.random() < settings["burst_r"]: self.bad = False
+        elif not self.bad and self.random.random() < settings["burst_p"]: self.bad = True
+        if self.bad and self.random.random() < settings["burst_loss"]: return True
+        return self.random.random() < settings["loss"]
+
+    def __shape(self, now, size) -> float:
+        '''Token bucket: return when the datagram may leave, or None if the queue of
+        datagrams waiting for tokens would exceed its limit'''
+        rate = self.settings["rate"] * 1000 / 8
+        if not rate: return now
+        start = max(now, self.stamp or now)
+        tokens = min(self.settings["bucket"], self.tokens + (start - (self.stamp or now)) * rate)
+        wait = max(0, (size - tokens) / rate)
+        if (start + wait - now) * rate > self.settings["queue"]: return None
+        self.tokens, self.stamp = tokens + wait * rate - size, start + wait
+        return start + wait
+
+    def __delay(self, spare) -> float:
+        '''Draw the propagation delay in seconds, with extra delay for reordered datagrams'''
+        if spare: return self.settings["delay"] / 1000
+        delay = self.settings["delay"] + self.random.uniform(0, self.settings["jitter"])
+        if self.random.random() < self.settings["reorder"]:
+            self.stats["reordered"] += 1
+            delay += self.settings["reorder_delay"]
+        return delay / 1000
+
+##################################################################
+# Relay
+##################################################################
+
+# Parse commandline arguments
+options = { "seed": "", "idle": 0.0, "codec": "binary" }
+for direction in ("fwd", "rev"): options.update({ f"{direction}_{i}": j for i, j in LINK.items() })
+args = parse_options(sys.argv[1:], options)
+if args is None or len(args) != 3 or options["codec"] not in CODECS: exit(PROXY_ERROR)
+try: port, receiver = int(args[0]), (args[1], int(args[2]))
+except: exit(PROXY_ERROR)
+
+links = { i: Link(i, { j: options[f"{i}_{j}"] for j in LINK }, options["seed"]) for i in ("fwd", "rev") }
+codec = CODECS[options["codec"]]()
+
+# Senders reach the listen socket, each is relayed from its own upstream socket
+listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+listener.bind((IP, port))
+upstreams, clients = dict(), dict()
+
+# Whether each sender's connection is between its first data segment and its FIN
+impaired = dict()
+
+# Datagrams in flight on either link: (departure, order, socket, datagram, destination)
+pending, order, last = list(), 0, time.monotonic()
+
+try:
+    while True:
+        now = time.monotonic()
+        while pending and pending[0][0] <= now:
+            _, _, sock, msg, addr = heapq.heappop(pending)
+            sock.sendto(msg, addr)
+        if options["idle"] and not pending and now - last > options["idle"]: break
+        wait = max(pending[0][0] - now, 0) if pending else options["idle"] or None
+        r, _, _ = select.select([listener] + list(clients), [], [], wait)
+        now = time.monotonic()
+        for sock in r:
+            msg, addr = sock.recvfrom(MAX_SEG_SIZE)
+            last = now
+            if sock is listener:
+                if addr not in upstreams:
+                    upstreams[addr] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    clients[upstreams[addr]] = addr
+                packet_type = codec.packet_type(msg)
+                if packet_type == Packet.DATA: impaired[addr] = True
+                elif packet_type in (Packet.SYN, Packet.FIN): impaired[addr] = False
+                link, out, destination, client = links["fwd"], upstreams[addr], receiver, addr
+            else: link, out, destination, client = links["rev"], listener, clients[sock], clients[sock]
+            for departure in link.departures(now, len(msg), not impaired.get(client)):
+                heapq.heappush(pending, (departure, order, out, msg, destination))
+                order += 1
+except KeyboardInterrupt: pass
+
+for link in links.values():
+    print(f"{link.name}: " + " ".join(f"{i} {j}" for i, j in link.stats.items()))
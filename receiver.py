@@ -10,6 +10,7 @@
 # Imports
 ##################################################################
 
+import os
 import sys
 import socket
 from helper import *
@@ -20,16 +21,29 @@ from helper import *
 
 IP = '127.0.0.1'
 RECEIVER_ERROR = \
-    'USAGE: python receiver.py receiver_port FileReceiverd.txt'
+    'USAGE: python receiver.py receiver_port FileReceiverd.txt [--codec binary|json] ' \
+    + '[--ack-every N] [--ack-delay ms] [--gro] [--serve] [--trace off|stats|full] ' \
+    + '[--trace-file trace.bin] [--max-mss bytes] [--rcvbuf bytes] [--resume] [--delta] ' \
+    + '[--session] [--zero-rtt token.key] [--tree]'
+SESSION_ERROR = 'A session is received into a directory, not served, resumed or taken as a delta'
 
 ##################################################################
 # PTP
 ##################################################################
 
 # Parse commandline arguments
-if (len(sys.argv) != 3): exit(RECEIVER_ERROR)
-try: port, filename = int(sys.argv[1]), sys.argv[2]
+options = { "codec": "binary", "ack_every": 1, "ack_delay": float(ACK_DELAY), "gro": False, 
+    "serve": False, "trace": Trace.FULL, "trace_file": "", "max_mss": MAX_MSS, 
+    "rcvbuf": RECEIVE_BUFFER, "resume": False, "delta": False, "session": False, "zero_rtt": "",
+    "tree": False }
+args = parse_options(sys.argv[1:], options)
+if args is None or len(args) != 2 or options["codec"] not in CODECS: exit(RECEIVER_ERROR)
+if options["ack_every"] < 1 or not 0 < options["max_mss"] <= MAX_MSS or options["rcvbuf"] < 1: exit(RECEIVER_ERROR)
+if options["trace"] not in (Trace.OFF, Trace.STATS, Trace.FULL): exit(RECEIVER_ERROR)
+try: port, filename = int(args[0]), args[1]
 except: exit(RECEIVER_ERROR)
+if options["session"] and options["tree"]: exit(RECEIVER_ERROR)
+if (options["session"] or options["tree"]) and (options["serve"] or options["resume"] or options["delta"]): exit(SESSION_ERROR)
 
 # Set initial sequence and acknowledgement number
 seq, ack = 154, 0
@@ -39,29 +53,59 @@ server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 server.bind((IP, port))
 
 # Instantiate receiver class
-receiver = Receiver(server, seq, ack)
+receiver = Receiver(server, seq, ack, CODECS[options["codec"]]())
+receiver.set_delayed_ack(options["ack_every"], options["ack_delay"])
+receiver.set_trace(options["trace"], options["trace_file"])
+receiver.set_limits(options["max_mss"], options["rcvbuf"])
+if options["gro"] and not receiver.enable_gro(): print("UDP GRO unavailable, reading one datagram per call")
+if options["resume"]: receiver.set_checkpoint(filename + ".ckpt")
+secret = token_secret(options["zero_rtt"]) if options["zero_rtt"] else None
+if secret: receiver.set_zero_rtt(secret)
 
-# Opening handshake
-receiver.receive(handshake=True)
-receiver.send(Data.NONE, Packet.SYNACK, handshake=True)
-receiver.receive(handshake=True)
+# A delta is rebuilt from the existing copy into a new file, which then replaces it
+basis = FileSource(filename) if options["delta"] and os.path.exists(filename) else None
+if basis: receiver.set_delta(basis)
+output = filename + ".delta" if basis else filename
 
-# Open and write to file until teardown
-with open(filename, "w") as file:
-    data = receiver.receive()
-    while data:
-        receiver.send(Data.NONE, Packet.ACK)
-        if data != Data.BUFFERED: file.write(data)
-        data = receiver.receive()
-    receiver.send(Data.NONE, Packet.FINACK, handshake=True)
-    receiver.receive(handshake=True)
+# Serve concurrent senders until interrupted. The nth connection is written to
+# FileReceived.n.txt and logged to Receiver_log.n.txt
+if options["serve"]:
+    root, ext = os.path.splitext(filename)
+    receivers = ReceiverServer(server, seq, lambda n, addr, cid: FileSink(f"{root}.{n}{ext}"), 
+        CODECS[options["codec"]]())
+    receivers.set_delayed_ack(options["ack_every"], options["ack_delay"])
+    receivers.set_trace(options["trace"])
+    receivers.set_limits(options["max_mss"], options["rcvbuf"])
+    if receiver.gro: receivers.enable_gro()
+    if secret: receivers.set_zero_rtt(secret)
+    try:
+        while True:
+            for i in receivers.poll(): write_receiver_log(i, f"Receiver_log.{i.number}.txt")
+    except KeyboardInterrupt: exit()
+
+# A session writes each file it carries under the directory FileReceived, by its base name.
+# A tree is recreated below it, and the modes and times of the sender's manifest applied
+if options["session"] or options["tree"]:
+    os.makedirs(filename, exist_ok=True)
+    tree = TreeSink(filename) if options["tree"] else None
+    if tree: receiver.set_tree(tree)
+    else: receiver.set_session(lambda name: FileSink(os.path.join(filename, os.path.basename(name))))
+    try: receiver.transfer(None)
+    except KeyboardInterrupt: exit()
+    if tree: tree.finish()
+    write_receiver_log(receiver, "Receiver_log.txt")
+    exit()
+
+# Write each segment at its offset in the preallocated file until teardown. An interrupted
+# resumable transfer saves its checkpoint
+with FileSink(output) as sink: 
+    try: receiver.transfer(sink)
+    except KeyboardInterrupt: 
+        receiver.save_checkpoint()
+        exit()
+if basis: 
+    basis.close()
+    os.replace(output, filename)
 
 # Create log file
-with open("Receiver_log.txt", "w") as logfile:
-    for a, b, c, d, e, f in receiver.get_log():
-        logfile.write(f"{a:<5} {b:<12} {c:<4} {d:<8} {f:<6} {e:<6}\n")
-    tot_data, num_seg, num_dup = receiver.get_stats()
-    logfile.write("\n--------- Log File Statistics ---------\n\n")
-    logfile.write(f"Total Data Received (bytes):     {tot_data}\n")
-    logfile.write(f"No. Data Segments Received:      {num_seg}\n")
-    logfile.write(f"No. Duplicate Segments:          {num_dup}\n\n")
+write_receiver_log(receiver, "Receiver_log.txt")
@@ -10,9 +10,9 @@
 # Imports
 ##################################################################
 
+import os
 import sys
 import socket
-import select
 from helper import *
 
 ##################################################################
@@ -21,32 +21,60 @@ from helper import *
 
 SENDER_ERROR = \
     'USAGE: python sender.py receiver_host_ip receiver_port ' \
-    + 'FileToSend.txt MWS MSS timeout pdrop seed'
+    + 'FileToSend.txt MWS MSS timeout pdrop seed [--codec binary|json] ' \
+    + '[--min-rto ms] [--max-rto ms] [--cc none|reno|cubic] [--gso] [--trace off|stats|full] ' \
+    + '[--trace-file trace.bin] [--auto-mss] [--fec K] [--compress LEVEL] [--adaptive] ' \
+    + '[--resume] [--delta] [--block bytes] [--pace off|auto|kbit/s] [--session] ' \
+    + '[--zero-rtt tokens.json] [--tree]'
+SESSION_ERROR = 'A session or tree is not resumed, compressed or sent as a delta'
 PDROP_ERROR = 'Pdrop parameter must be between 0 and 1'
-MSS_ERROR = 'Maximum Segment Size must be greater than 0'
+MSS_ERROR = f'Maximum Segment Size must be between 1 and {MAX_MSS}'
 
 ##################################################################
 # PTP
 ##################################################################
 
 # Parse commandline arguments
-if (len(sys.argv) != 9): exit(SENDER_ERROR)
+options = { "codec": "binary", "min_rto": float(MIN_RTO), "max_rto": float(MAX_RTO), "cc": "reno", 
+    "gso": False, "trace": Trace.FULL, "trace_file": "", "auto_mss": False, "fec": 0,
+    "compress": 0, "adaptive": False, "resume": False,
+    "delta": False, "block": 0, "pace": "off", "session": False, "zero_rtt": "",
+    "tree": False }
+args = parse_options(sys.argv[1:], options)
+if args is None or len(args) != 8: exit(SENDER_ERROR)
+if options["codec"] not in CODECS or options["cc"] not in CONGESTION_CONTROLS: exit(SENDER_ERROR)
+if options["trace"] not in (Trace.OFF, Trace.STATS, Trace.FULL): exit(SENDER_ERROR)
+if not 0 <= options["fec"] < 128: exit(SENDER_ERROR)
+if not 0 <= options["compress"] <= 9 or options["block"] < 0: exit(SENDER_ERROR)
+if options["pace"] not in ("off", "auto"):
+    try: options["pace"] = float(options["pace"])
+    except ValueError: exit(SENDER_ERROR)
+    if options["pace"] <= 0: exit(SENDER_ERROR)
 try:
     ip, port, filename, MWS, MSS, timeout, pdrop, seed = (
-        sys.argv[1], int(sys.argv[2]), 
-        sys.argv[3], int(sys.argv[4]), 
-        int(sys.argv[5]), float(sys.argv[6]), 
-        float(sys.argv[7]), sys.argv[8], 
+        args[0], int(args[1]), 
+        args[2], int(args[3]), 
+        int(args[4]), float(args[5]), 
+        float(args[6]), args[7], 
     )
 except: exit(SENDER_ERROR)
 
 # Basic error handling
-if not 0 < pdrop < 1: exit(PDROP_ERROR)
-if MSS <= 0: exit(MSS_ERROR)
+if not 0 <= pdrop < 1: exit(PDROP_ERROR)
+if not 0 < MSS <= MAX_MSS: exit(MSS_ERROR)
+if options["session"] and options["tree"]: exit(SENDER_ERROR)
+if (options["session"] or options["tree"]) and (options["resume"] or options["delta"] or options["compress"]): exit(SESSION_ERROR)
+
+# A session sends every file listed in FileToSend.txt, one path per line, on one connection
+if options["session"]:
+    with open(filename) as listing: filenames = [i.strip() for i in listing if i.strip()]
 
 # Set initial sequence and acknowledgement number
 seq, ack = 121, 0
 
+# Offer the largest segment that fits the path MTU and let the receiver lower it
+if options["auto_mss"]: MSS = AUTO_MSS
+
 # Calculate window size
 window_length = int(MWS/MSS)
 
@@ -54,49 +82,35 @@ window_length = int(MWS/MSS)
 client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
 # Instantiate sender class
-sender = Sender(client, seq, ack, window_length, (ip, port))
+sender = Sender(client, seq, ack, window_length, (ip, port), CODECS[options["codec"]]())
+sender.set_window(MSS, MWS)
+if options["fec"]: sender.set_fec(options["fec"])
+if options["compress"]: sender.set_compression(options["compress"], options["adaptive"])
+if options["resume"]: sender.set_resumable(file_identity(filename))
+if options["delta"]: sender.set_delta(options["block"])
+sender.set_trace(options["trace"], options["trace_file"])
 sender.set_PL_module(seed, pdrop)
+sender.set_rto(timeout, options["min_rto"], options["max_rto"])
+sender.set_congestion_control(CONGESTION_CONTROLS[options["cc"]](MSS))
+if options["pace"] != "off": sender.set_pacing(options["pace"] * 1000 / 8 if options["pace"] != "auto" else 0)
+if options["zero_rtt"]: sender.set_token(read_token(options["zero_rtt"], f"{ip}:{port}"))
+if options["gso"] and not sender.enable_gso(): print("UDP GSO unavailable, sending one segment per datagram")
+
+# Map file for reading and send it. If the file does not exist, throw error. A tree sends
+# the directory FileToSend.txt, less the files the receiver already holds
+if not options["session"] and not options["tree"]:
+    with FileSource(filename) as file: sender.transfer(file)
+else:
+    if options["tree"] and not os.path.isdir(filename): exit(SENDER_ERROR)
+    try: session = TreeSource(filename) if options["tree"] else SessionSource(filenames)
+    except ValueError as error: exit(str(error))
+    with session: 
+        sender.set_session(session)
+        try: sender.transfer(session)
+        except ConnectionRefusedError as error: exit(str(error))
+
+# Keep the receiver's latest connection token for the next connection
+if options["zero_rtt"] and sender.token: write_token(options["zero_rtt"], f"{ip}:{port}", sender.token)
 
-# Opening handshake
-sender.send(Data.NONE, Packet.SYN, handshake=True)
-sender.receive(handshake=True)
-sender.send(Data.NONE, Packet.ACK, handshake=True)
-
-# Polled send and receive functions
-def poll_send():
-    global packet
-    _, w, _ = select.select([], [client], [], timeout/1000)
-    while w and not sender.is_full() and packet:
-        if sender.PL_module(): sender.send(packet, Packet.DATA)
-        else: sender.drop(packet, Packet.DATA)
-        packet = file.read(MSS)
-
-def poll_receive():
-    r, w, e = select.select([client], [], [], timeout/1000)
-    if r: sender.receive()
-    if not (r or w or e): 
-        for i in sender.window.data_to_resend(): sender.resend(*i, Packet.DATA)
-
-# Open file for reading. If the file does not exist, throw error
-with open(filename, "r") as file:
-    packet = file.read(MSS)
-    while packet:
-        poll_send()
-        poll_receive()
-    while not sender.is_empty(): poll_receive()
-    # Initiate teardown -> no connection or teardown packets will be dropped
-    sender.send(Data.NONE, Packet.FIN, handshake=True)
-    sender.receive(handshake=True)
-    sender.send(Data.NONE, Packet.ACK, handshake=True)
-    
 # Create log file
-with open("Sender_log.txt", "w") as logfile:
-    for a, b, c, d, e, f in sender.get_log():
-        logfile.write(f"{a:<5} {b:<12} {c:<4} {d:<8} {f:<6} {e:<6}\n")
-    tot_data, num_seg, drp_pkt, re_seg, dup_ack = sender.get_stats()
-    logfile.write("\n--------- Log File Statistics ---------\n\n")
-    logfile.write(f"Total Data Transferred (bytes):  {tot_data}\n")
-    logfile.write(f"No. Data Segments Sent:          {num_seg}\n")
-    logfile.write(f"No. Packets Dropped:             {drp_pkt}\n")
-    logfile.write(f"No. Retransmitted Segments:      {re_seg}\n")
-    logfile.write(f"No. Duplicate Acknowledgements:  {dup_ack}\n\n")
+write_sender_log(sender, "Sender_log.txt")
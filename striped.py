@@ -0,0 +1,141 @@
+##################################################################
+# Striped Transfer
+#
+# Splits one file into byte ranges and sends each range with its
+# own Sender in a worker process, on its own UDP flow to port + i.
+# The receiving side runs one Receiver per stripe, each writing its
+# range at the offset announced in the SYN, so the stripes are
+# reassembled into one output file. Both sides report per-stripe
+# and aggregate throughput.
+#
+# USAGE: python striped.py receive receiver_port FileReceived.txt [--stripes N]
+#            [--codec binary|json] [--ack-every N] [--ack-delay ms] [--gro]
+#        python striped.py send receiver_host_ip receiver_port FileToSend.txt MWS MSS
+#            timeout pdrop seed [--stripes N] [--codec binary|json] [--min-rto ms]
+#            [--max-rto ms] [--cc none|reno|cubic] [--gso]
+##################################################################
+
+##################################################################
+# Imports
+##################################################################
+
+import os
+import sys
+import time
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from helper import *
+
+##################################################################
+# Constants
+##################################################################
+
+IP = '127.0.0.1'
+STRIPED_ERROR = \
+    'USAGE: python striped.py receive receiver_port FileReceived.txt [--stripes N] ' \
+    + '[--codec binary|json] [--ack-every N] [--ack-delay ms] [--gro]\n' \
+    + '       python striped.py send receiver_host_ip receiver_port FileToSend.txt MWS MSS ' \
+    + 'timeout pdrop seed [--stripes N] [--codec binary|json] [--min-rto ms] [--max-rto ms] ' \
+    + '[--cc none|reno|cubic] [--gso]'
+
+##################################################################
+# Stripes
+##################################################################
+
+def stripe_ranges(size, stripes, MSS) -> list:
+    '''Split size bytes into contiguous ranges of whole segments, one per stripe'''
+    length = -(-size // (stripes * MSS)) * MSS
+    return [(min(i * length, size), min((i + 1) * length, size)) for i in range(stripes)]
+
+def send_stripe(index, start, end, ip, port, filename, MWS, MSS, timeout, pdrop, seed,
+        options) -> tuple:
+    '''Send bytes start to end of the file to port + index. Return the stripe index,
+    bytes sent and seconds taken'''
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = Sender(client, 121, 0, int(MWS/MSS), (ip, port + index), CODECS[options["codec"]]())
+    sender.set_PL_module(f"{seed}.{index}", pdrop)
+    sender.set_rto(timeout, options["min_rto"], options["max_rto"])
+    sender.set_congestion_control(CONGESTION_CONTROLS[options["cc"]](MSS))
+    sender.set_window(MSS, MWS)
+    sender.set_offset(start)
+    if options["gso"]: sender.enable_gso()
+    begin = time.perf_counter()
+    with FileSource(filename, start, end) as file: sender.transfer(file)
+    seconds = time.perf_counter() - begin
+    client.close()
+    write_sender_log(sender, f"Sender_log.{index}.txt")
+    return index, end - start, seconds
+
+def receive_stripe(index, port, filename, options) -> tuple:
+    '''Receive one stripe on port + index into the shared output file. Return the stripe
+    index, bytes received and seconds from SYN to teardown'''
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind((IP, port + index))
+    receiver = Receiver(server, 154, 0, CODECS[options["codec"]]())
+    receiver.set_delayed_ack(options["ack_every"], options["ack_delay"])
+    if options["gro"]: receiver.enable_gro()
+    with FileSink(filename) as sink: receiver.transfer(sink)
+    server.close()
+    write_receiver_log(receiver, f"Receiver_log.{index}.txt")
+    return index, receiver.stats["tot_data"], (receiver.trace.last - receiver.trace.first) / 1e9
+
+def report(results, total, seconds) -> None:
+    '''Print per-stripe and aggregate throughput'''
+    print(f"{'stripe':<8} {'bytes':>12} {'seconds':>9} {'Mbit/s':>9}")
+    for index, size, elapsed in sorted(results):
+        print(f"{index:<8} {size:>12} {elapsed:>9.3f} {size * 8 / max(elapsed, 1e-9) / 1e6:>9.2f}")
+    print(f"{'total':<8} {total:>12} {seconds:>9.3f} {total * 8 / max(seconds, 1e-9) / 1e6:>9.2f}")
+
+##################################################################
+# PTP
+##################################################################
+
+def receive(args, options) -> None:
+    '''Receive a striped file, one worker process per stripe'''
+    try: port, filename = int(args[0]), args[1]
+    except: exit(STRIPED_ERROR)
+    begin = time.perf_counter()
+    with ProcessPoolExecutor(options["stripes"]) as pool:
+        results = list(pool.map(receive_stripe, range(options["stripes"]),
+            [port] * options["stripes"], [filename] * options["stripes"],
+            [options] * options["stripes"]))
+    report(results, os.path.getsize(filename), time.perf_counter() - begin)
+
+def send(args, options) -> None:
+    '''Send a file in stripes, one worker process per stripe'''
+    try:
+        ip, port, filename, MWS, MSS, timeout, pdrop, seed = (
+            args[0], int(args[1]),
+            args[2], int(args[3]),
+            int(args[4]), float(args[5]),
+            float(args[6]), args[7],
+        )
+    except: exit(STRIPED_ERROR)
+    if not 0 <= pdrop < 1 or MSS <= 0: exit(STRIPED_ERROR)
+    size = os.path.getsize(filename)
+    begin = time.perf_counter()
+    with ProcessPoolExecutor(options["stripes"]) as pool:
+        jobs = [pool.submit(send_stripe, i, start, end, ip, port, filename, MWS, MSS, timeout,
+            pdrop, seed, options) for i, (start, end) in
+            enumerate(stripe_ranges(size, options["stripes"], MSS))]
+        results = [i.result() for i in jobs]
+    report(results, size, time.perf_counter() - begin)
+
+if __name__ == "__main__":
+    # Worker processes import this module, so only the parent parses arguments
+    mode = sys.argv[1] if len(sys.argv) > 1 else None
+    if mode == "receive":
+        options = { "stripes": 4, "codec": "binary", "ack_every": 1,
+            "ack_delay": float(ACK_DELAY), "gro": False }
+        args = parse_options(sys.argv[2:], options)
+        if args is None or len(args) != 2: exit(STRIPED_ERROR)
+    elif mode == "send":
+        options = { "stripes": 4, "codec": "binary", "min_rto": float(MIN_RTO),
+            "max_rto": float(MAX_RTO), "cc": "reno", "gso": False }
+        args = parse_options(sys.argv[2:], options)
+        if args is None or len(args) != 8 or options["cc"] not in CONGESTION_CONTROLS:
+            exit(STRIPED_ERROR)
+    else: exit(STRIPED_ERROR)
+    if options["stripes"] < 1 or options["codec"] not in CODECS: exit(STRIPED_ERROR)
+    if mode == "receive": receive(args, options)
+    else: send(args, options)
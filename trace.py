@@ -0,0 +1,25 @@
+##################################################################
+# Trace Converter
+#
+# Renders a binary trace file written with --trace-file as the
+# packet rows of the text log (Sender_log.txt/Receiver_log.txt).
+#
+# USAGE: python trace.py trace.bin [log.txt]
+##################################################################
+
+##################################################################
+# Imports
+##################################################################
+
+import sys
+from helper import read_trace, trace_rows, write_rows
+
+##################################################################
+# Converter
+##################################################################
+
+if len(sys.argv) not in (2, 3): exit("USAGE: python trace.py trace.bin [log.txt]")
+epoch, records = read_trace(sys.argv[1])
+if len(sys.argv) == 2: write_rows(sys.stdout, trace_rows(epoch, records))
+else:
+    with open(sys.argv[2], "w") as logfile: write_rows(logfile, trace_rows(epoch, records))
@@ -14,17 +14,19 @@ from helper import SenderWindow, ReceiverWindow, Slot
 
 sender = SenderWindow(4)
 
-sender.add(1, 1, "asdf")
-sender.add(2, 1, "asdf")
-sender.add(3, 1, "asdf")
-sender.add(4, 1, "asdf")
-
-sender.ack(1)
-# sender.ack(2)
-# sender.ack(3)
-sender.ack(4)
-
-sender.printWindow()
+sender.add(5, 1, b"asdf", 0)
+sender.add(9, 1, b"asdf", 0)
+sender.add(13, 1, b"asdf", 0)
+sender.add(17, 1, b"asdf", 0)
+
+print(sender.is_full(), sender.in_flight)
+print(sender.ack(5))
+print(sender.oldest())
+# With the newest packet SACKed, the first hole is the packet ending at 9
+print(sender.sack(13, 17), sender.next_hole(5, 17))
+# One cumulative ack releases the remaining three slots
+print(sender.ack(17))
+print(sender.is_empty(), sender.in_flight, sender.oldest(), sender.next_hole(5, 17))
 
 # receiver = ReceiverWindow(1, 1)
 # sender = SenderWindow(4)